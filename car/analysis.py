@@ -1,32 +1,170 @@
 import pymysql
+import sys
+from collections import Counter
+
+# 统计用价格区间：(排序, 标签, 上限万元)，左闭右开
+STATS_PRICE_RANGES = [
+    (1, '10万以下', 10),
+    (2, '10-20万', 20),
+    (3, '20-30万', 30),
+    (4, '30-50万', 50),
+    (5, '50万以上', None)
+]
+UNKNOWN_BRAND = '未知品牌'
+# 需要维护累计和的规范化字段（用于求平均值）
+STATS_METRICS = ['price_wan', 'reg_year', 'mileage_km']
+
+
+def init_stats_tables(cursor):
+    """创建统计汇总表（品牌计数、价格区间计数、年份分布、累计和）"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_brand (
+        brand VARCHAR(64) PRIMARY KEY,
+        count INT NOT NULL DEFAULT 0
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_price_range (
+        price_range VARCHAR(16) PRIMARY KEY,
+        sort_order TINYINT NOT NULL,
+        count INT NOT NULL DEFAULT 0
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_year (
+        reg_year SMALLINT PRIMARY KEY,
+        count INT NOT NULL DEFAULT 0
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_summary (
+        metric VARCHAR(32) PRIMARY KEY,
+        value_sum DECIMAL(20,2) NOT NULL DEFAULT 0,
+        value_count BIGINT NOT NULL DEFAULT 0
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """)
+
+
+def price_range_of(price_wan):
+    """返回价格所属的统计区间 (排序, 标签)"""
+    for sort_order, label, high in STATS_PRICE_RANGES:
+        if high is None or price_wan < high:
+            return sort_order, label
+
+
+def apply_stats_delta(cursor, records, sign=1):
+    """把一批记录的增量（sign=-1 为扣减）累加到汇总表，由调用方在同一事务内提交
+
+    records 为包含 brand/price_wan/reg_year/mileage_km 的字典列表
+    """
+    if not records:
+        return
+    brands = Counter()
+    price_ranges = Counter()
+    years = Counter()
+    sums = {metric: [0, 0] for metric in STATS_METRICS}
+    for record in records:
+        brands[record.get('brand') or UNKNOWN_BRAND] += 1
+        if record.get('price_wan') is not None:
+            price_ranges[price_range_of(record['price_wan'])] += 1
+        if record.get('reg_year') is not None:
+            years[record['reg_year']] += 1
+        for metric in STATS_METRICS:
+            if record.get(metric) is not None:
+                sums[metric][0] += record[metric]
+                sums[metric][1] += 1
+
+    cursor.executemany("""
+        INSERT INTO stats_brand (brand, count) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, [(brand, sign * n) for brand, n in brands.items()])
+    cursor.executemany("""
+        INSERT INTO stats_price_range (price_range, sort_order, count) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, [(label, sort_order, sign * n) for (sort_order, label), n in price_ranges.items()])
+    cursor.executemany("""
+        INSERT INTO stats_year (reg_year, count) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, [(year, sign * n) for year, n in years.items()])
+    cursor.executemany("""
+        INSERT INTO stats_summary (metric, value_sum, value_count) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE value_sum = value_sum + VALUES(value_sum),
+                                value_count = value_count + VALUES(value_count)
+    """, [(metric, sign * total, sign * n) for metric, (total, n) in sums.items() if n])
+
+
+def rebuild_statistics(conn):
+    """根据 carprice 全量重建统计汇总表（用于恢复或首次迁移）"""
+    case_sql = " ".join(
+        f"WHEN price_wan < {high} THEN '{label}'" for _, label, high in STATS_PRICE_RANGES if high is not None)
+    last_label = STATS_PRICE_RANGES[-1][1]
+    order_sql = " ".join(f"WHEN '{label}' THEN {sort_order}" for sort_order, label, _ in STATS_PRICE_RANGES)
+    try:
+        with conn.cursor() as cursor:
+            init_stats_tables(cursor)
+            for table in ('stats_brand', 'stats_price_range', 'stats_year', 'stats_summary'):
+                cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"""
+                INSERT INTO stats_brand (brand, count)
+                SELECT IF(brand = '' OR brand IS NULL, '{UNKNOWN_BRAND}', brand) AS b, COUNT(*)
+                FROM carprice GROUP BY b
+            """)
+            cursor.execute(f"""
+                INSERT INTO stats_price_range (price_range, sort_order, count)
+                SELECT r, CASE r {order_sql} END, COUNT(*) FROM (
+                    SELECT CASE {case_sql} ELSE '{last_label}' END AS r
+                    FROM carprice WHERE price_wan IS NOT NULL
+                ) ranges GROUP BY r
+            """)
+            cursor.execute("""
+                INSERT INTO stats_year (reg_year, count)
+                SELECT reg_year, COUNT(*) FROM carprice WHERE reg_year IS NOT NULL GROUP BY reg_year
+            """)
+            for metric in STATS_METRICS:
+                cursor.execute(f"""
+                    INSERT INTO stats_summary (metric, value_sum, value_count)
+                    SELECT '{metric}', COALESCE(SUM({metric}), 0), COUNT({metric}) FROM carprice
+                """)
+            # 统计结果变化，数据版本加 1（与 database.bump_data_version 相同）
+            cursor.execute("UPDATE catalog_meta SET value = value + 1 WHERE name = 'data_version'")
+        conn.commit()
+        print("统计汇总表重建完成")
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"重建统计汇总表失败: {e}")
+        return False
+
+
+def ensure_statistics(conn):
+    """创建汇总表；汇总表为空而 carprice 有数据时（旧库升级）全量重建"""
+    with conn.cursor() as cursor:
+        init_stats_tables(cursor)
+        cursor.execute("SELECT COUNT(*) FROM stats_summary")
+        empty = cursor.fetchone()[0] == 0
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM carprice)")
+        has_cars = cursor.fetchone()[0]
+    conn.commit()
+    if empty and has_cars:
+        rebuild_statistics(conn)
+
 
 def get_statistics_data(conn):
-    """获取统计分析数据"""
+    """获取统计分析数据（读取入库时维护的汇总表，与 carprice 行数无关）"""
     try:
         with conn.cursor(pymysql.cursors.DictCursor) as cursor:
             # 年份分布统计（柱状图数据）
             cursor.execute("""
-                SELECT 
-                    SUBSTRING_INDEX(SUBSTRING_INDEX(caryear, '年份：', -1), '年', 1) AS year,
-                    COUNT(*) AS count
-                FROM carprice
-                WHERE caryear LIKE '%年份：%年%'
-                GROUP BY year
-                ORDER BY year ASC
+                SELECT reg_year AS year, count FROM stats_year
+                WHERE count > 0
+                ORDER BY reg_year ASC
             """)
-            year_data = cursor.fetchall()
+            year_data = [{'year': str(row['year']), 'count': row['count']} for row in cursor.fetchall()]
 
             # 品牌分布百分比+其他
-            cursor.execute("SELECT carname FROM carprice")
-            all_cars = cursor.fetchall()
-            brand_counter = {}
-            total = len(all_cars)
-            for row in all_cars:
-                carname = row['carname']
-                brand = carname.split()[0] if carname else '未知品牌'
-                brand_counter[brand] = brand_counter.get(brand, 0) + 1
-            # 按数量排序
-            sorted_brands = sorted(brand_counter.items(), key=lambda x: x[1], reverse=True)
+            cursor.execute("SELECT brand, count FROM stats_brand WHERE count > 0 ORDER BY count DESC")
+            sorted_brands = [(row['brand'], row['count']) for row in cursor.fetchall()]
+            total = sum(count for _, count in sorted_brands)
             top_brands = sorted_brands[:10]
             other_count = sum([x[1] for x in sorted_brands[10:]])
             pie_data = []
@@ -39,70 +177,27 @@ def get_statistics_data(conn):
 
             # 价格区间分布
             cursor.execute("""
-                SELECT 
-                    CASE 
-                        WHEN CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2)) < 10 THEN '10万以下'
-                        WHEN CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2)) BETWEEN 10 AND 20 THEN '10-20万'
-                        WHEN CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2)) BETWEEN 20 AND 30 THEN '20-30万'
-                        WHEN CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2)) BETWEEN 30 AND 50 THEN '30-50万'
-                        WHEN CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2)) > 50 THEN '50万以上'
-                        ELSE '其他'
-                    END as price_range,
-                    COUNT(*) as count
-                FROM carprice
-                WHERE carmoney LIKE '￥%'
-                GROUP BY price_range
-                ORDER BY 
-                    CASE price_range
-                        WHEN '10万以下' THEN 1
-                        WHEN '10-20万' THEN 2
-                        WHEN '20-30万' THEN 3
-                        WHEN '30-50万' THEN 4
-                        WHEN '50万以上' THEN 5
-                        ELSE 6
-                    END
+                SELECT price_range, count FROM stats_price_range
+                WHERE count > 0
+                ORDER BY sort_order
             """)
             price_range_data = cursor.fetchall()
 
-            # 平均价格
-            cursor.execute("""
-                SELECT AVG(CAST(REPLACE(REPLACE(REPLACE(carmoney, '￥', ''), '万', ''), '', '') AS DECIMAL(10,2))) as avg_price
-                FROM carprice
-                WHERE carmoney LIKE '￥%'
-            """)
-            avg_price = cursor.fetchone()['avg_price']
+            # 统计总数（入库时维护）
+            cursor.execute("SELECT value FROM catalog_meta WHERE name = 'total_count'")
+            row = cursor.fetchone()
+            total_count = row['value'] if row else total
 
-            # 统计总数
-            cursor.execute("SELECT COUNT(*) as total_count FROM carprice")
-            total_count = cursor.fetchone()['total_count']
+            # 平均价格、平均年份、平均里程（累计和 / 计数）
+            cursor.execute("SELECT metric, value_sum, value_count FROM stats_summary")
+            averages = {row['metric']: float(row['value_sum']) / row['value_count']
+                        for row in cursor.fetchall() if row['value_count']}
+            avg_price = averages.get('price_wan', 0)
+            avg_year = averages.get('reg_year', 0)
+            avg_mileage = averages.get('mileage_km', 0)
 
-            # 平均车龄
-            cursor.execute("""
-                SELECT AVG(CAST(SUBSTRING_INDEX(SUBSTRING_INDEX(caryear, '年份： ', -1), '年', 1) AS UNSIGNED)) as avg_year
-                FROM carprice
-                WHERE caryear LIKE '%年份： %年%'
-            """)
-            avg_year_result = cursor.fetchone()
-            avg_year = avg_year_result['avg_year'] if avg_year_result['avg_year'] else 0
-
-            # 平均里程
-            cursor.execute("""
-                SELECT AVG(
-                    CASE 
-                        WHEN caryear LIKE '%万公里%' THEN 
-                            CAST(REPLACE(SUBSTRING_INDEX(SUBSTRING_INDEX(caryear, '公里：', -1), '万公里', 1), '万', '') AS DECIMAL(10,2)) * 10000
-                        WHEN caryear LIKE '%公里%' THEN 
-                            CAST(REPLACE(SUBSTRING_INDEX(SUBSTRING_INDEX(caryear, '公里：', -1), '公里', 1), ',', '') AS UNSIGNED)
-                    END
-                ) as avg_mileage
-                FROM carprice
-                WHERE caryear LIKE '%公里：%%公里%'
-            """)
-            avg_mileage_result = cursor.fetchone()
-            avg_mileage = avg_mileage_result['avg_mileage'] if avg_mileage_result['avg_mileage'] else 0
-
-            # 品牌��数
-            brand_count = len(brand_counter)
+            # 品牌总数
+            brand_count = len(sorted_brands)
 
             # 返回统计数据
             return {
@@ -118,3 +213,12 @@ def get_statistics_data(conn):
     except Exception as e:
         print(f"读取统计数据失败: {e}")
         return None
+
+
+if __name__ == '__main__':
+    # 全量重建统计汇总表：python car/analysis.py --rebuild
+    if '--rebuild' in sys.argv:
+        from database import get_conn
+        with get_conn() as conn:
+            sys.exit(0 if rebuild_statistics(conn) else 1)
+    print("用法: python car/analysis.py --rebuild")
@@ -1,15 +1,30 @@
-from database import get_conn, read_data, verify_user, create_user, check_username_exists
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from database import get_conn, read_data, read_data_seek, read_data_by_price, verify_user, create_user, \
+    check_username_exists, pool_stats, car_rows_to_dicts, get_detail_attrs, get_data_version, on_data_version_change, \
+    export_filters, iter_export_rows, EXPORT_COLUMNS, read_data_by_ids, PRICE_SEGMENTS
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, make_response, \
+    get_template_attribute, g, Response, stream_with_context
+from markupsafe import Markup
 from pyecharts.charts import Pie, Line, Bar
 from pyecharts import options as opts
 from pathlib import Path
+from datetime import datetime
+from decimal import Decimal
 import urllib.parse
+import itertools
+import threading
+import hashlib
+import json
+import csv
+import io
+import time
 import pymysql
 import sys
 import os
-import re
-from utils import safe_name, q, QINIU_DOMAIN
+from utils import safe_name, variant_key, QINIU_DOMAIN, SignedUrlCache, PageCache, FRAGMENT_CACHE_TTL, LRUCache
 from analysis import get_statistics_data
+from recommend import RecommendationPool
+from search import SearchIndex
+from facets import FacetIndex, MILEAGE_SEGMENTS
 from functools import wraps
 import requests
 
@@ -23,6 +38,12 @@ app.secret_key = 'your_secret_key_here'  # 用于会话加密
 
 LOCAL_IMG_DIR = 'car_img'
 
+# 图片签名链接缓存
+signed_url_cache = SignedUrlCache()
+# 匿名访问的页面渲染缓存（按 page_etag 区分）和首页推荐区块片段缓存
+page_cache = PageCache()
+fragment_cache = PageCache(max_size=4, ttl=FRAGMENT_CACHE_TTL)
+
 
 def login_required(f):
     """装饰器：检查用户是否已登录"""
@@ -34,61 +55,148 @@ def login_required(f):
     return decorated_function
 
 
-def get_ai_recommended_cars(conn, top_n=8):
-    # 按价格、年份、品牌等简单规则推荐
-    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
-        cursor.execute("""
-            SELECT id, carname, carmoney, caryear
-            FROM carprice
-            ORDER BY RAND()  -- 随机推荐
-            LIMIT %s
-        """, (top_n,))
-        results = cursor.fetchall()
-        # 解析数据
-        cars = []
-        for row in results:
-            parts = row['carname'].split()
-            brand = parts[0] if parts else "未知品牌"
-            model = " ".join(parts[1:]) if len(parts) > 1 else "未知型号"
-            year = "未知"
-            mileage = "里程待询"
-            if row['caryear']:
-                clean_caryear = row['caryear'].replace('', '')  # 移除特殊字符
-                year_match = re.search(r'(\d{4})年', clean_caryear)
-                if year_match:
-                    year = year_match.group(1)
-                mileage_match = re.search(r'([\d.]+万?)公里', clean_caryear)
-                if mileage_match:
-                    mileage = mileage_match.group(1) + "公里"
-                elif re.search(r'(\d+\.?\d*)万?公[里里]', clean_caryear):
-                    mileage_match = re.search(r'(\d+\.?\d*)万?公[里里]', clean_caryear)
-                    if mileage_match:
-                        mileage = mileage_match.group(1) + "万公里"
-                else:
-                    # 如果没有匹配到"万"字，尝试匹配普通数字
-                    mileage_match = re.search(r'(\d+\.?\d*)公[里里]', clean_caryear)
-                    if mileage_match:
-                        mileage = mileage_match.group(1) + "公里"
-            cars.append({
-                'id': row['id'],
-                'brand': brand,
-                'model': model,
-                'price': row['carmoney'],
-                'name': row['carname'],
-                'year': year,
-                'mileage': mileage,
-                'image_path': get_image_path(row['carname'], 1)  # 使用固定索引1，与爬虫逻辑保持一致
-            })
-        return cars
+def page_etag():
+    """当前请求的强 ETag：数据版本 + 路由参数 + 登录用户 + 图片签名时间窗
+
+    图片签名链接会过期，签名时间窗变化后 ETag 随之变化，避免客户端复用带过期链接的页面
+    """
+    parts = [
+        get_data_version(),
+        request.path,
+        sorted(request.args.items(multi=True)),
+        session.get('user'),
+        int(time.time()) // signed_url_cache.bucket,
+    ]
+    digest = hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+    return f"v{parts[0]}-{digest[:16]}"
+
+
+def versioned(view):
+    """装饰器：按数据版本生成 ETag，客户端缓存仍有效时直接返回 304（不查询 MySQL）"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            etag = g.page_etag = page_etag()
+        except Exception as e:
+            print(f"读取数据版本失败: {e}")
+            return view(*args, **kwargs)
+        cache_control = f"{'private' if 'user' in session else 'public'}, no-cache"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+
+# 首页推荐区块占位符：页面缓存中保存占位符，返回前替换为单独短时缓存的推荐片段
+RECOMMEND_SLOTS = ('<!--fragment:recommend-carousel-->', '<!--fragment:recommend-grid-->')
+
+
+def recommendation_fragments():
+    """首页推荐区块（轮播、推荐卡片）的 HTML，缓存 FRAGMENT_CACHE_TTL 秒，所有用户共用"""
+    key = ('recommend', int(time.time()) // signed_url_cache.bucket)
+    fragments = fragment_cache.get(key)
+    if fragments is None:
+        start = time.perf_counter()
+        cars = get_ai_recommended_cars(top_n=8)
+        fragments = tuple(str(get_template_attribute('_recommendations.html', name)(cars))
+                          for name in ('carousel_items', 'grid_items'))
+        fragment_cache.put(key, fragments, time.perf_counter() - start)
+    return fragments
+
+
+def fill_fragments(body):
+    if RECOMMEND_SLOTS[0] in body:
+        for slot, html in zip(RECOMMEND_SLOTS, recommendation_fragments()):
+            body = body.replace(slot, html)
+    return body
+
+
+def page_cached(view):
+    """装饰器：匿名访问时按 page_etag()（数据版本 + 路由参数 + 签名时间窗）缓存渲染好的页面；
+    登录用户（导航栏因人而异）直接渲染。返回前填入推荐片段"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'user' in session:
+            page_cache.bypass()
+            result = view(*args, **kwargs)
+            return fill_fragments(result) if isinstance(result, str) else result
+        try:
+            key = g.get('page_etag') or page_etag()
+        except Exception as e:
+            print(f"读取数据版本失败: {e}")
+            return view(*args, **kwargs)
+        body = page_cache.get(key)
+        if body is None:
+            start = time.perf_counter()
+            result = view(*args, **kwargs)
+            if not isinstance(result, str):
+                # 404/500 等非正常页面不缓存
+                return result
+            page_cache.put(key, result, time.perf_counter() - start)
+            body = result
+        return fill_fragments(body)
+    return wrapper
+
+
+def get_ai_recommended_cars(top_n=8, weighted=False):
+    # 从进程内候选池抽样推荐，热路径不访问数据库
+    return recommendation_pool.sample(top_n, weighted=weighted)
+
+
+def _image_url(carname, index, ext='.jpg', size=None, fmt='jpg'):
+    name = f"{safe_name(carname)}_{index}{ext}"
+    key = f"car_images/{name}" if size is None else variant_key(name, size, fmt)
+    return f"{QINIU_DOMAIN}/{urllib.parse.quote(key)}"
+
+
+def get_image_path(carname, index, ext='.jpg', size=None, fmt='jpg'):
+    # 生成带token的私有下载链接（有效期1小时），未临近过期前复用缓存的签名
+    # size 为 utils.IMAGE_VARIANTS 中的缩略图尺寸（fmt 为 webp/jpg），None 为原图
+    return signed_url_cache.get((carname, index, ext, size, fmt),
+                                lambda: _image_url(carname, index, ext, size, fmt))
+
+
+def image_urls(carname, size, prefix='image'):
+    """某一尺寸的图片地址：<prefix>_webp、<prefix>_path（JPEG 兜底），以及缩略图缺失时回退的原图"""
+    return {
+        f'{prefix}_webp': get_image_path(carname, 1, size=size, fmt='webp'),
+        f'{prefix}_path': get_image_path(carname, 1, size=size),
+        'image_original': get_image_path(carname, 1),
+    }
+
+
+# 推荐候选池（使用固定索引1的图片，与爬虫逻辑保持一致）：推荐卡片用 card，首页轮播用 hero
+recommendation_pool = RecommendationPool(
+    lambda carname: {**image_urls(carname, 'card'), **image_urls(carname, 'hero', prefix='hero')})
+# 数据版本变化（有新入库）时候选池过期，下次请求后台刷新；旧版本的页面缓存不会再命中，直接清空
+on_data_version_change(lambda version: recommendation_pool.invalidate())
+on_data_version_change(lambda version: page_cache.clear())
+
+# 车名搜索倒排索引：启动时后台全量构建，数据版本变化后下次查询前增量更新
+search_index = SearchIndex()
+on_data_version_change(lambda version: search_index.invalidate())
 
+# 列表页多条件筛选的位图索引：数据版本变化后下次请求时重建
+facet_index = FacetIndex()
+on_data_version_change(lambda version: facet_index.invalidate())
+FACET_BRAND_LIMIT = 20      # 品牌筛选最多显示的选项数（按数量排序，已选中的始终显示）
 
-def get_image_path(carname, index, ext='.jpg'):
-    sname = safe_name(carname)
-    encoded_name = urllib.parse.quote(f"{sname}_{index}{ext}")
-    url = f"{QINIU_DOMAIN}/car_images/{encoded_name}"
-    # 生成带token的私有下载链接（有效期1小时）
-    private_url = q.private_download_url(url, expires=3600)
-    return private_url
+
+def _attach_images(cars):
+    """为车辆列表补充图片地址等展示字段"""
+    for car in cars:
+        # 修改图片路径生成方式，使用固定索引1，与首页保持一致；列表卡片使用 card 缩略图
+        car.update(image_urls(car['name'], 'card'))
+        car['year'] = car.get('year', "未知")
+        car['mileage'] = car.get('mileage', "里程待询")
+    return cars
 
 
 def get_car_data(page=1, per_page=24):
@@ -96,46 +204,62 @@ def get_car_data(page=1, per_page=24):
     cars = []
     total_count = 0  # 总记录数
     try:
-        conn = get_conn()
-        # 从数据库读取分页数据和总记录数
-        cars, total_count = read_data(conn, page=page, per_page=per_page)
+        with get_conn() as conn:
+            # 从数据库读取分页数据和总记录数
+            cars, total_count = read_data(conn, page=page, per_page=per_page)
     except Exception as e:
         print(f"数据库读取失败: {e}")
         return [], 0
 
     # 处理数据库数据
-    if cars:
-        for i, car in enumerate(cars):
-            # 修改图片路径生成方式，使用固定索引1，与首页保持一致
-            car['image_path'] = get_image_path(car['name'], 1)
-            car['year'] = car.get('year', "未知")
-            car['mileage'] = car.get('mileage', "里程待询")
-        return cars, total_count
+    return _attach_images(cars), total_count
+
+
+def get_car_data_seek(after_id=None, before_id=None, per_page=24):
+    """按游标获取分页的汽车数据，返回 (cars, total_count, prev_cursor, next_cursor)"""
+    try:
+        with get_conn() as conn:
+            cars, total_count, prev_cursor, next_cursor = read_data_seek(
+                conn, after_id=after_id, before_id=before_id, per_page=per_page)
+    except Exception as e:
+        print(f"数据库读取失败: {e}")
+        return [], 0, None, None
+    return _attach_images(cars), total_count, prev_cursor, next_cursor
 
 
 @app.route('/')
+@versioned
+@page_cached
 def index():
-    # 获取当前页码（默认第1页）
+    # 获取当前页码（默认第1页），after/before 为游标分页参数
     page = request.args.get('page', 1, type=int)
+    after_id = request.args.get('after', type=int)
+    before_id = request.args.get('before', type=int)
     per_page = 24  # 每页固定24辆
 
-    # 获取分页数据和总记录数
-    current_cars, total_count = get_car_data(page=page, per_page=per_page)
+    # 获取分页数据和总记录数（带游标时按 id 定位，不做 OFFSET 扫描）
+    if after_id is not None or before_id is not None:
+        current_cars, total_count, prev_cursor, next_cursor = get_car_data_seek(
+            after_id=after_id, before_id=before_id, per_page=per_page)
+    else:
+        current_cars, total_count = get_car_data(page=page, per_page=per_page)
+        prev_cursor = current_cars[0]['id'] if current_cars and page > 1 else None
+        next_cursor = current_cars[-1]['id'] if current_cars and page * per_page < total_count else None
 
     # 计算总页数（向上取整）
     total_pages = (total_count + per_page - 1) // per_page if total_count > 0 else 1
 
-    # 智能推荐热门车辆
-    conn = get_conn()
-    recommended_cars = get_ai_recommended_cars(conn, top_n=8)
-
     return render_template(
         'index.html',
         cars=current_cars,
-        recommended_cars=recommended_cars,  # 首页推荐车辆
+        # 首页推荐车辆：先放占位符，由 page_cached 填入单独缓存的推荐片段
+        recommend_carousel=Markup(RECOMMEND_SLOTS[0]),
+        recommend_grid=Markup(RECOMMEND_SLOTS[1]),
         current_page=page,
         total_pages=total_pages,
-        total_count=total_count
+        total_count=total_count,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
 
 
@@ -147,9 +271,8 @@ def login():
         
         # 数据库验证用户
         try:
-            conn = get_conn()
-            user = verify_user(conn, username, password)
-            conn.close()
+            with get_conn() as conn:
+                user = verify_user(conn, username, password)
             
             if user:
                 # 登录成功，设置会话
@@ -191,16 +314,13 @@ def register():
             return render_template('register.html', error='密码长度至少为6位')
         
         try:
-            conn = get_conn()
-            
-            # 检查用户名是否已存在
-            if check_username_exists(conn, username):
-                conn.close()
-                return render_template('register.html', error='用户名已存在')
-            
-            # 创建新用户
-            user_id = create_user(conn, username, password)
-            conn.close()
+            with get_conn() as conn:
+                # 检查用户名是否已存在
+                if check_username_exists(conn, username):
+                    return render_template('register.html', error='用户名已存在')
+
+                # 创建新用户
+                user_id = create_user(conn, username, password)
             
             if user_id:
                 # 注册成功，重定向到登录页面
@@ -216,92 +336,87 @@ def register():
     return render_template('register.html')
 
 
+# 列表页筛选参数：(分面, URL 参数名)，同一参数可出现多次（多选）
+FACET_PARAMS = (('brand', 'brand'), ('price', 'price_category'), ('mileage', 'mileage'))
+
+
+def _facet_filters():
+    """从请求参数读取筛选条件（品牌/价格区间/里程区间多选，年份为区间）"""
+    filters = {}
+    for name, param in FACET_PARAMS:
+        values = [value for value in request.args.getlist(param) if value and value != 'all']
+        if values:
+            filters[name] = values
+    for key in ('year_min', 'year_max'):
+        value = request.args.get(key, type=int)
+        if value is not None:
+            filters[key] = value
+    return filters
+
+
+def _filter_pairs(filters):
+    """筛选条件转换为查询参数列表（不含页码）"""
+    pairs = []
+    for name, param in FACET_PARAMS:
+        pairs.extend((param, value) for value in filters.get(name, ()))
+    pairs.extend((key, filters[key]) for key in ('year_min', 'year_max') if key in filters)
+    return pairs
+
+
+def _facet_options(filters, counts):
+    """列表页筛选项：每项包含数量、是否选中，以及切换该项后的链接"""
+    def option(name, value):
+        selected = value in filters.get(name, ())
+        toggled = dict(filters)
+        values = [v for v in filters.get(name, ()) if v != value] if selected else filters.get(name, []) + [value]
+        toggled[name] = values
+        return {
+            'label': value,
+            'count': counts[name].get(value, 0),
+            'selected': selected,
+            'url': '/cars?' + urllib.parse.urlencode(_filter_pairs(toggled))
+        }
+
+    brands = sorted(counts['brand'], key=lambda brand: -counts['brand'][brand])
+    shown = brands[:FACET_BRAND_LIMIT] + [b for b in filters.get('brand', ()) if b not in brands[:FACET_BRAND_LIMIT]]
+    return {
+        'brand': [option('brand', brand) for brand in shown],
+        'price': [option('price', tag) for _, _, tag in PRICE_SEGMENTS],
+        'mileage': [option('mileage', tag) for _, _, tag in MILEAGE_SEGMENTS],
+        'years': sorted(counts['year'].items(), reverse=True),
+        # 年份表单提交时保留其余筛选条件
+        'hidden': [(param, value) for param, value in _filter_pairs(filters) if param not in ('year_min', 'year_max')]
+    }
+
+
 # 二手车列表页面路由
 @app.route('/cars')
+@versioned
+@page_cached
 def car_list():
     # 获取当前页码（默认第1页）
     page = request.args.get('page', 1, type=int)
     per_page = 24  # 每页固定24辆
 
-    # 获取价格分类参数
-    price_category = request.args.get('price_category', 'all')
-
-    # 根据价格分类获取车辆
-    def get_cars_by_price_category_local(category: str = 'all'):
-        """
-        根据价格分类获取车辆的本地实现
-        """
-        # 获取所有车辆数据
-        all_cars, _ = get_car_data(page=1, per_page=10000)  # 获取所有车辆
-
-        # 如果是获取所有车辆，直接返回
-        if category == 'all':
-            # 为所有车辆添加价格标签
-            for car in all_cars:
-                # 使用本地的价格转换和分类函数
-                price_value = _to_float_local(car['price'])
-                price_label = _label_local(price_value)
-                car['price_label'] = price_label
-            return all_cars
-
-        # 筛选特定分类的车辆
-        classified_cars = []
-        for car in all_cars:
-            # 使用本地的价格转换和分类函数
-            price_value = _to_float_local(car['price'])
-            price_label = _label_local(price_value)
-
-            # 如果分类匹配，则添加到结果中
-            if price_label == category:
-                car['price_label'] = price_label
-                classified_cars.append(car)
-
-        return classified_cars
-
-    # 本地实现的工具函数
-    def _to_float_local(carmoney: str):
-        """
-        把原始价格字符串转成浮点数
-        """
-        try:
-            return float(carmoney.replace("￥", "").replace("万", "").replace("", ""))
-        except Exception:
-            return -1.0
-
-    def _label_local(price: float):
-        """
-        根据价格返回对应标签
-        这个函数将车辆价格转换为用户友好的价格区间标签，用于在前端界面显示。
-        价格区间配置：左闭右开，单位"万元"
-        Args:
-            price: 车辆价格（以万元为单位）
-        Returns:
-            str: 对应的价格区间标签，如"经济实惠"、"家用首选"等
-        """
-        # 价格区间配置：左闭右开，单位"万元"
-        PRICE_SEG_LOCAL = [
-            (0, 10, "经济实惠"),
-            (10, 20, "家用首选"),
-            (20, 30, "品质之选"),
-            (30, 50, "豪华舒适"),
-            (50, float('inf'), "高端定制")
-        ]
-
-        if price < 0:
-            return "价格异常"
-        for low, high, tag in PRICE_SEG_LOCAL:
-            if low <= price < high:
-                return tag
-        # 兜底（理论上不会走到）
-        return "价格异常"
-
-    # 调用本地函数
-    all_cars = get_cars_by_price_category_local(price_category)
-
-    # 对筛选后的数据进行手动分页
-    total_count = len(all_cars)
-    offset = (page - 1) * per_page
-    current_cars = all_cars[offset:offset + per_page]
+    # 品牌、年份、里程、价格任意组合：位图索引求交得到当前页 id 和各筛选项数量，再按主键取当前页
+    filters = _facet_filters()
+    facets = None
+    current_cars, total_count = [], 0
+    result = facet_index.query(filters, page=page, per_page=per_page)
+    try:
+        with get_conn() as conn:
+            if result is not None:
+                page_ids, total_count, counts = result
+                current_cars = read_data_by_ids(conn, page_ids)
+                facets = _facet_options(filters, counts)
+            else:
+                # 索引不可用（如数据库刚恢复）：退回只按单个价格区间在 SQL 中筛选
+                price_category = filters.get('price', ['all'])[0]
+                current_cars, total_count = read_data_by_price(conn, price_category, page=page, per_page=per_page)
+    except Exception as e:
+        print(f"数据库读取失败: {e}")
+        current_cars, total_count = [], 0
+    _attach_images(current_cars)
 
     # 计算总页数（向上取整）
     total_pages = (total_count + per_page - 1) // per_page if total_count > 0 else 1
@@ -312,7 +427,32 @@ def car_list():
         current_page=page,
         total_pages=total_pages,
         total_count=total_count,
-        current_category=price_category
+        current_category=filters.get('price', ['all'])[0],
+        filters=filters,
+        facets=facets,
+        filter_query=urllib.parse.urlencode(_filter_pairs(filters))
+    )
+
+
+@app.route('/search')
+@versioned
+@page_cached
+def search():
+    """车名搜索结果页（复用列表页模板）"""
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    cars, total_count = search_index.search(query, page=page) if query else ([], 0)
+    _attach_images(cars)
+    total_pages = (total_count + search_index.page_size - 1) // search_index.page_size if total_count > 0 else 1
+
+    return render_template(
+        'index.html',
+        cars=cars,
+        current_page=page,
+        total_pages=total_pages,
+        total_count=total_count,
+        query=query,
+        filter_query=urllib.parse.urlencode({'q': query}) if query else ''
     )
 
 
@@ -383,20 +523,47 @@ def create_charts(stats_data):
     return pie, line, bar
 
 
+# 图表渲染缓存：按统计数据指纹缓存 render_embed() 结果和 JSON 配置项
+CHART_CACHE_SIZE = 8
+chart_cache = LRUCache(CHART_CACHE_SIZE, time_name='render_time')
+
+
+def stats_fingerprint(stats_data):
+    """统计数据指纹，数据不变则指纹不变"""
+    payload = json.dumps(stats_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def get_rendered_charts(stats_data):
+    """返回 {'pie', 'line', 'bar', 'options'}，统计数据未变化时直接复用上次的渲染结果"""
+    key = stats_fingerprint(stats_data)
+    rendered = chart_cache.get(key)
+    if rendered is not None:
+        return rendered
+
+    start = time.perf_counter()
+    charts = dict(zip(('pie', 'line', 'bar'), create_charts(stats_data)))
+    rendered = {name: chart.render_embed() if chart else None for name, chart in charts.items()}
+    rendered['options'] = {name: json.loads(chart.dump_options_with_quotes()) if chart else None
+                           for name, chart in charts.items()}
+    chart_cache.put(key, rendered, cost=time.perf_counter() - start)
+    return rendered
+
+
 @app.route('/analytics')
 @login_required
 def analytics():
     """数据分析页面"""
     try:
-        conn = get_conn()
-        stats_data = get_statistics_data(conn)
+        with get_conn() as conn:
+            stats_data = get_statistics_data(conn)
         if stats_data:
-            pie_chart, line_chart, bar_chart = create_charts(stats_data)
+            charts = get_rendered_charts(stats_data)
             return render_template(
                 'analytics.html',
-                pie_chart=pie_chart.render_embed() if pie_chart else None,
-                line_chart=line_chart.render_embed(),
-                bar_chart=bar_chart.render_embed() if bar_chart else None,
+                pie_chart=charts['pie'],
+                line_chart=charts['line'],
+                bar_chart=charts['bar'],
                 stats_data=stats_data
             )
         else:
@@ -406,13 +573,39 @@ def analytics():
         return "服务器内部错误", 500
 
 
+@app.route('/api/chart_options')
+@login_required
+def chart_options_api():
+    """API接口：图表的 ECharts 配置项（JSON），供前端直接 setOption 渲染"""
+    try:
+        with get_conn() as conn:
+            stats_data = get_statistics_data(conn)
+        if stats_data:
+            return jsonify({
+                'success': True,
+                'version': stats_fingerprint(stats_data),
+                'data': get_rendered_charts(stats_data)['options']
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'message': '无法获取统计数据'
+            })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取图表配置时出错: {str(e)}'
+        })
+
+
 @app.route('/api/statistics')
 @login_required
+@versioned
 def statistics_api():
     """提供统计数据的API接口"""
     try:
-        conn = get_conn()
-        stats_data = get_statistics_data(conn)
+        with get_conn() as conn:
+            stats_data = get_statistics_data(conn)
         if stats_data:
             return jsonify({
                 'success': True,
@@ -431,46 +624,23 @@ def statistics_api():
 
 
 @app.route('/car/<int:car_id>')
+@versioned
+@page_cached
 def car_detail(car_id):
     """车辆详情页面（修复图片路径）"""
     try:
-        conn = get_conn()
-        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        with get_conn() as conn, conn.cursor(pymysql.cursors.DictCursor) as cursor:
             cursor.execute("""
-                SELECT id, carname, carmoney, caryear 
+                SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, infoid
                 FROM carprice 
                 WHERE id = %s
             """, (car_id,))
             car = cursor.fetchone()
+            attrs = get_detail_attrs(conn, car['infoid']) if car else {}
         if car:
-            image_path = get_image_path(car['carname'], 1)
-            # 解析年份和里程
-            year = "未知"
-            mileage = "里程待询"
-            caryear_str = car.get('caryear', "")
-            if caryear_str:
-                # 提取年份（如 2014年、2022年）
-                year_match = re.search(r'(\d{4})年', caryear_str)
-                if year_match:
-                    year = year_match.group(1)
-                # 提取里程（如 3.1万公里、41700公里）
-                mileage_match = re.search(r'([\d.]+万?)公里', caryear_str)
-                if mileage_match:
-                    mileage = mileage_match.group(1) + "公里"
-                else:
-                    mileage_match = re.search(r'([\d,]+)公里', caryear_str)
-                    if mileage_match:
-                        mileage = mileage_match.group(1).replace(",", "") + "公里"
-            car_data = {
-                'id': car['id'],
-                'brand': car['carname'].split()[0] if car['carname'] else "未知品牌",
-                'model': " ".join(car['carname'].split()[1:]) if car['carname'] else "未知型号",
-                'name': car['carname'],
-                'price': car['carmoney'],
-                'year': year,
-                'mileage': mileage,
-                'image_path': image_path
-            }
+            car_data = car_rows_to_dicts([car])[0]
+            car_data.update(image_urls(car['carname'], 'detail'))
+            car_data['attrs'] = attrs  # 详情页参数（spider.py --details 抓取）
             return render_template('car_detail.html', car=car_data)
         else:
             return "车辆未找到", 404
@@ -483,9 +653,7 @@ def car_detail(car_id):
 def refresh_recommendations():
     """API接口：获取新的推荐车辆"""
     try:
-        conn = get_conn()
-        recommended_cars = get_ai_recommended_cars(conn, top_n=8)
-        conn.close()
+        recommended_cars = get_ai_recommended_cars(top_n=8)
         
         # 转换为可JSON序列化的格式
         cars_data = []
@@ -497,7 +665,9 @@ def refresh_recommendations():
                 'price': car['price'],
                 'year': car['year'],
                 'mileage': car['mileage'],
-                'image_path': car['image_path']
+                'image_path': car['image_path'],
+                'image_webp': car['image_webp'],
+                'image_original': car['image_original']
             })
         
         return jsonify({
@@ -512,6 +682,166 @@ def refresh_recommendations():
         }), 500
 
 
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _export_value(value):
+    """导出时的值转换：DECIMAL 转浮点数，TIMESTAMP 转 ISO 格式字符串"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def _parse_since(value):
+    """updated_since 参数：ISO 日期/时间（2024-05-01 或 2024-05-01T08:00:00）或 Unix 时间戳"""
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def _export_chunks(batches, fmt):
+    """把数据库批次编码成响应块，每批一块"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+    for rows in batches:
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([_export_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+        else:
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_value, row))), ensure_ascii=False) + '\n'
+                          for row in rows)
+
+
+@app.route('/api/cars/export')
+def export_cars():
+    """API接口：流式导出车源（format=ndjson|csv），按 id 升序
+
+    筛选参数：brand、price_category、min_price/max_price（万元）、min_year/max_year、
+    updated_since（只导出该时间之后新增或变化的车源，用于增量拉取）
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f'不支持的导出格式: {fmt}'}), 400
+    try:
+        filters = export_filters(
+            brand=request.args.get('brand'),
+            price_category=request.args.get('price_category'),
+            min_price=request.args.get('min_price', type=float),
+            max_price=request.args.get('max_price', type=float),
+            min_year=request.args.get('min_year', type=int),
+            max_year=request.args.get('max_year', type=int),
+            updated_since=_parse_since(request.args.get('updated_since'))
+        )
+    except (ValueError, OverflowError, OSError):
+        # 时间戳超出范围（如 1e20、inf）时 fromtimestamp 抛出 OverflowError/OSError
+        return jsonify({'success': False, 'message': 'updated_since 格式错误'}), 400
+    if filters is None:
+        return jsonify({'success': False, 'message': '未知的价格区间'}), 400
+
+    # 先执行查询并取第一批，数据库出错时还能返回错误状态码
+    try:
+        data_version = get_data_version()
+        conn = get_conn()
+    except Exception as e:
+        print(f"导出车源失败: {e}")
+        return jsonify({'success': False, 'message': '数据库暂时不可用'}), 503
+    batches = iter_export_rows(conn, *filters)
+    try:
+        first = next(batches, None)
+    except Exception as e:
+        print(f"导出车源失败: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': f'导出车源时出错: {str(e)}'}), 500
+
+    def generate():
+        finished = False
+        try:
+            yield from _export_chunks(itertools.chain([first] if first else [], batches), fmt)
+            finished = True
+        except Exception as e:
+            # 响应头已发出，只能中断传输，客户端据此判断导出不完整
+            print(f"导出车源中断: {e}")
+            raise
+        finally:
+            # 客户端断开时结果集还没读完，直接关闭连接，不在归还时把剩余行读完
+            if finished:
+                conn.close()
+            else:
+                conn.discard()
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=cars.{fmt}'
+    response.headers['X-Data-Version'] = str(data_version)
+    return response
+
+
+@app.route('/api/search')
+def search_api():
+    """API接口：车名搜索，按相关度排序分页返回"""
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    if not query:
+        return jsonify({'success': False, 'message': '请输入搜索关键词'}), 400
+    # 与页面路由一样先读取数据版本，版本变化时触发搜索索引的增量更新
+    try:
+        get_data_version()
+    except Exception as e:
+        print(f"读取数据版本失败: {e}")
+    start = time.perf_counter()
+    cars, total_count = search_index.search(query, page=page)
+    took_ms = (time.perf_counter() - start) * 1000
+    _attach_images(cars)
+    return jsonify({
+        'success': True,
+        'query': query,
+        'page': page,
+        'per_page': search_index.page_size,
+        'total': total_count,
+        'took_ms': round(took_ms, 3),
+        'cars': [{key: car[key] for key in ('id', 'name', 'brand', 'model', 'price', 'year', 'mileage',
+                                            'image_path', 'image_webp', 'image_original')}
+                 for car in cars]
+    })
+
+
+@app.route('/api/pool_stats')
+@login_required
+def pool_stats_api():
+    """API接口：数据库连接池计数器（使用中连接数、等待时间等）"""
+    return jsonify({
+        'success': True,
+        'data': pool_stats()
+    })
+
+
+@app.route('/api/cache_stats')
+@login_required
+def cache_stats_api():
+    """API接口：进程内缓存计数器（命中率、耗时等）"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'signed_url': signed_url_cache.stats(),
+            'charts': chart_cache.stats(),
+            'pages': page_cache.stats(),
+            'fragments': fragment_cache.stats(),
+            'search': search_index.stats(),
+            'facets': facet_index.stats(),
+            'data_version': get_data_version()
+        }
+    })
+
+
 @app.route('/api/check_login')
 def check_login():
     return jsonify({'logged_in': 'user' in session})
@@ -561,4 +891,7 @@ def ai_assistant():
 if __name__ == '__main__':
     # 确保本地图片目录存在
     Path(LOCAL_IMG_DIR).mkdir(exist_ok=True)
+    # 后台构建搜索索引和筛选索引，构建完成前的相关请求会等待
+    threading.Thread(target=search_index.ensure_current, daemon=True).start()
+    threading.Thread(target=facet_index.ensure_current, daemon=True).start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# 爬取断点：记录每次爬取及每页状态，支持 --resume 只抓未完成的页面
+import pymysql
+from database import get_conn
+
+PAGE_PENDING = 'pending'
+PAGE_DONE = 'done'
+PAGE_FAILED = 'failed'
+PAGE_SKIPPED = 'skipped'    # 增量模式下因已追上旧数据而未抓取
+
+
+def init_crawl_tables(conn):
+    """创建爬取状态表"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_runs (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                mode VARCHAR(16) NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'running',
+                pages_total INT NOT NULL DEFAULT 0,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_pages (
+                run_id INT NOT NULL,
+                page INT NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                records INT NOT NULL DEFAULT 0,
+                attempts INT NOT NULL DEFAULT 0,
+                error VARCHAR(255) NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (run_id, page),
+                INDEX idx_run_status (run_id, status)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
+            conn.commit()
+    except Exception as e:
+        print(f"初始化爬取状态表失败: {e}")
+        conn.rollback()
+
+
+def start_run(pages, mode='full'):
+    """登记一次新的爬取，所有页面置为 pending，返回 run_id"""
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("INSERT INTO crawl_runs (mode, pages_total) VALUES (%s, %s)", (mode, len(pages)))
+        run_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO crawl_pages (run_id, page) VALUES (%s, %s)",
+                           [(run_id, page) for page in pages])
+        conn.commit()
+    return run_id
+
+
+def resume_run():
+    """找到最近一次未完成的爬取，返回 (run_id, 待抓取页码列表)；没有则返回 (None, [])"""
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM crawl_runs WHERE status <> 'done' ORDER BY id DESC LIMIT 1")
+        row = cursor.fetchone()
+        if not row:
+            return None, []
+        run_id = row[0]
+        cursor.execute("""
+            SELECT page FROM crawl_pages
+            WHERE run_id = %s AND status IN (%s, %s)
+            ORDER BY page
+        """, (run_id, PAGE_PENDING, PAGE_FAILED))
+        pages = [r[0] for r in cursor.fetchall()]
+        cursor.execute("UPDATE crawl_runs SET status = 'running' WHERE id = %s", (run_id,))
+        conn.commit()
+    return run_id, pages
+
+
+def mark_page(run_id, page, status, records=0, error=None):
+    """更新单页状态（每次调用计一次尝试）；已完成的页面不会再被改为失败或跳过"""
+    # 入库回调和页面超时可能先后到达，done 只能被 done 覆盖
+    params = [status, records, (error or '')[:255] or None, run_id, page]
+    keep_done = ""
+    if status != PAGE_DONE:
+        keep_done = "AND status <> %s"
+        params.append(PAGE_DONE)
+    try:
+        with get_conn() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE crawl_pages
+                SET status = %s, records = %s, error = %s, attempts = attempts + 1
+                WHERE run_id = %s AND page = %s {keep_done}
+            """, params)
+            conn.commit()
+    except Exception as e:
+        print(f"更新页面状态失败（页码：{page}）: {e}")
+
+
+def finish_run(run_id):
+    """所有页面都已完成或跳过时把本次爬取标记为 done，否则标记为 failed，返回最终状态"""
+    with get_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) FROM crawl_pages
+            WHERE run_id = %s AND status IN (%s, %s)
+        """, (run_id, PAGE_PENDING, PAGE_FAILED))
+        unfinished = cursor.fetchone()[0]
+        status = 'done' if unfinished == 0 else 'failed'
+        cursor.execute("UPDATE crawl_runs SET status = %s, finished_at = NOW() WHERE id = %s", (status, run_id))
+        conn.commit()
+    return status
+
+
+def last_successful_run():
+    """最近一次成功完成的爬取记录"""
+    with get_conn() as conn, conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("""
+            SELECT id, mode, pages_total, started_at, finished_at FROM crawl_runs
+            WHERE status = 'done' ORDER BY id DESC LIMIT 1
+        """)
+        return cursor.fetchone()
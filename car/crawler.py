@@ -0,0 +1,474 @@
+# asyncio 爬虫引擎：共享一个 aiohttp 客户端，用信号量限制全局和单域名并发，
+# 图片下载、上传为独立的流水线阶段
+import asyncio
+import functools
+import random
+import time
+from urllib.parse import urlsplit
+import aiohttp
+import charset_normalizer
+from database import get_conn, filter_new_records
+from crawl_state import mark_page, PAGE_DONE, PAGE_FAILED, PAGE_SKIPPED
+import thumbnails
+from image_store import IMAGE_COPIED, IMAGE_SKIPPED, IMAGE_UPLOADED
+from utils import IMAGE_VARIANTS, IMAGE_VARIANT_FORMATS, variant_key
+from spider import LIST_URL, HEADERS, parse_list_page, image_jobs, store_records, upload_bytes, copy_object
+
+CRAWL_CONCURRENCY = 8           # 全局最大并发请求数
+CRAWL_PER_HOST = 3              # 单个域名最大并发请求数
+# 单域名自适应限速（AIMD）：成功且延迟正常时速率加性增加，
+# 遇到 429/5xx/超时或延迟过高时乘性减小
+CRAWL_HOST_RATE = 3.0           # 初始速率（次/秒）
+CRAWL_HOST_MIN_RATE = 0.2       # 速率下限
+CRAWL_HOST_MAX_RATE = 10.0      # 速率上限
+RATE_INCREASE = 0.1             # 每次正常响应增加的速率
+RATE_DECREASE = 0.5             # 被限流时速率乘以该系数
+RATE_DECREASE_COOLDOWN = 2.0    # 两次减速的最小间隔（秒），避免同一波失败把速率连续砍到底
+SLOW_LATENCY = 3.0              # 响应超过该秒数视为服务端吃力，同样减速
+RETRY_AFTER_MAX = 60            # Retry-After 最多遵守的秒数
+CRAWL_REQUEST_TIMEOUT = 15      # 单个请求超时（秒）
+CRAWL_PAGE_TIMEOUT = 120        # 单个列表页处理超时（秒）
+
+# 图片流水线：页面解析 -> 图片分发 -> 下载池 -> 上传池，下载、上传之前为有界队列
+DOWNLOAD_WORKERS = 6            # 图片下载并发数
+UPLOAD_WORKERS = 4              # 七牛上传并发数
+DOWNLOAD_QUEUE_SIZE = 200       # 待下载队列上限，满时图片分发等待（不阻塞页面阶段）
+UPLOAD_QUEUE_SIZE = 50          # 待上传队列上限（内存中的图片数据），满时下载阶段等待
+DOWNLOAD_RETRIES = 3            # 下载最多尝试次数
+UPLOAD_RETRIES = 3              # 上传最多尝试次数
+PAGE_RETRIES = 3                # 列表页最多尝试次数
+RETRY_BACKOFF = 0.5             # 重试退避基数（秒），按 2 的幂增长，加随机抖动
+RETRY_MAX_BACKOFF = 30          # 单次退避上限（秒）
+
+
+def decode_html(content):
+    """按内容探测编码解码页面（与 requests 的 apparent_encoding 一致）"""
+    best = charset_normalizer.from_bytes(content).best()
+    return content.decode(best.encoding if best else 'utf-8', errors='replace')
+
+
+def run_blocking(func, *args):
+    """在默认线程池中执行阻塞调用（磁盘、数据库、七牛上传），不占用事件循环
+
+    与 asyncio.to_thread 相同，但 Python 3.8 也可用
+    """
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+def _variant_keys(name):
+    """原图文件名对应的全部缩略图 key"""
+    return [variant_key(name, size, fmt) for size in IMAGE_VARIANTS for fmt in IMAGE_VARIANT_FORMATS]
+
+
+class AdaptiveThrottle:
+    """单域名自适应限速：并发上限 + 请求开始间隔 1 / rate，rate 按响应情况 AIMD 调整"""
+
+    def __init__(self, limit, rate=CRAWL_HOST_RATE, min_rate=CRAWL_HOST_MIN_RATE, max_rate=CRAWL_HOST_MAX_RATE,
+                 increase=RATE_INCREASE, decrease=RATE_DECREASE, slow_latency=SLOW_LATENCY):
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_latency = slow_latency
+        self._semaphore = asyncio.Semaphore(limit)
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+        self._last_decrease = float('-inf')
+        self.counters = {'ok': 0, 'slow': 0, 'throttled': 0, 'errors': 0, 'decreases': 0}
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            async with self._lock:
+                loop = asyncio.get_running_loop()
+                delay = self._next_start - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._next_start = max(loop.time(), self._next_start) + 1 / self.rate
+        except BaseException:
+            # 等待期间被取消：归还名额
+            self._semaphore.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._semaphore.release()
+
+    def record_success(self, latency):
+        """正常响应：延迟正常时加速，过慢时减速"""
+        if latency > self.slow_latency:
+            self.counters['slow'] += 1
+            self._slow_down()
+        else:
+            self.counters['ok'] += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def record_throttled(self, retry_after=None):
+        """429/503：减速，并在 Retry-After 内暂停该域名的新请求"""
+        self.counters['throttled'] += 1
+        self._slow_down()
+        if retry_after:
+            loop = asyncio.get_running_loop()
+            self._next_start = max(self._next_start, loop.time() + min(retry_after, RETRY_AFTER_MAX))
+
+    def record_error(self):
+        """其他 5xx、超时、连接错误"""
+        self.counters['errors'] += 1
+        self._slow_down()
+
+    def _slow_down(self):
+        now = time.monotonic()
+        if now - self._last_decrease < RATE_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.counters['decreases'] += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+def _retry_after(headers):
+    """解析 Retry-After 秒数（不支持 HTTP 日期格式时返回 None）"""
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _retryable(exc):
+    """4xx（429 除外）不重试，其余错误（5xx、超时、连接错误、上传失败）重试"""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return True
+
+
+async def with_retries(func, attempts, backoff=RETRY_BACKOFF, max_backoff=RETRY_MAX_BACKOFF):
+    """调用协程函数 func，失败时按指数退避（加随机抖动）重试，返回 (结果, 重试次数)"""
+    for attempt in range(attempts):
+        try:
+            return await func(), attempt
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt == attempts - 1 or not _retryable(e):
+                raise
+            # 等量抖动：一半固定退避 + 一半随机，避免多个任务同时重试
+            delay = min(max_backoff, backoff * (2 ** attempt))
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+
+class AsyncCrawler:
+    """并发抓取列表页和图片；解析复用 spider.parse_list_page，入库交给 IngestWriter"""
+
+    def __init__(self, writer=None, concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST,
+                 host_rate=CRAWL_HOST_RATE, request_timeout=CRAWL_REQUEST_TIMEOUT,
+                 page_timeout=CRAWL_PAGE_TIMEOUT, with_images=True,
+                 download_workers=DOWNLOAD_WORKERS, upload_workers=UPLOAD_WORKERS,
+                 download_retries=DOWNLOAD_RETRIES, upload_retries=UPLOAD_RETRIES, page_retries=PAGE_RETRIES,
+                 run_id=None, incremental=False, cache=None, manifest=None, with_variants=True):
+        self.writer = writer
+        self.cache = cache              # HTTP 响应缓存（http_cache.ResponseCache），为 None 时不发条件请求
+        self.manifest = manifest        # 已上传图片清单（image_store.ImageManifest），为 None 时总是上传
+        self.with_variants = with_variants  # 上传原图后生成并上传缩略图（需要 Pillow）
+        self.run_id = run_id            # 爬取断点记录（crawl_state），为 None 时不记录
+        self.incremental = incremental  # 增量模式：整页都是已有车源时停止继续翻页
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_rate = host_rate
+        self.request_timeout = request_timeout
+        self.page_timeout = page_timeout
+        self.with_images = with_images
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.download_retries = download_retries
+        self.upload_retries = upload_retries
+        self.page_retries = page_retries
+        self._semaphore = None
+        self._page_semaphore = None
+        self._hosts = {}
+        self._session = None
+        self._image_feed = None
+        self._download_queue = None
+        self._upload_queue = None
+        self._stop_page = None          # 增量模式下追上旧数据的页码，之后的页面跳过
+        self._pages_done = set()        # 记录已写入数据库的页码，超时时不再算作失败
+        self.stats = {'pages': 0, 'pages_failed': 0, 'pages_skipped': 0, 'records': 0, 'images': 0,
+                      'images_failed': 0, 'uploads': 0, 'uploads_copied': 0, 'uploads_skipped': 0,
+                      'uploads_failed': 0, 'variants': 0, 'variants_failed': 0, 'retries': 0,
+                      'not_modified': 0, 'images_unchanged': 0, 'bytes': 0, 'elapsed': 0.0}
+
+    async def fetch(self, url, cached_body=True, conditional=True):
+        """在全局和单域名并发限制下下载 url，返回 (内容, 响应头, 是否 304)
+
+        启用响应缓存时带上条件请求头（conditional=False 时不带，总是下载完整内容）；
+        服务端返回 304 时，cached_body=True 返回缓存的内容，否则内容为 None（图片只需要知道没有变化）
+        """
+        validators = {}
+        if self.cache is not None and conditional:
+            validators = await run_blocking(self.cache.conditional_headers, url, cached_body)
+        host = urlsplit(url).netloc
+        throttle = self._hosts.get(host)
+        if throttle is None:
+            throttle = self._hosts[host] = AdaptiveThrottle(self.per_host, self.host_rate)
+        async with throttle, self._semaphore:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                async with self._session.get(url, headers=validators) as resp:
+                    if resp.status in (429, 503):
+                        throttle.record_throttled(_retry_after(resp.headers))
+                    elif resp.status >= 500:
+                        throttle.record_error()
+                    not_modified = resp.status == 304 and bool(validators)
+                    if not not_modified:
+                        resp.raise_for_status()
+                        content = await resp.read()
+                    headers = resp.headers
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                throttle.record_error()
+                raise
+            throttle.record_success(loop.time() - start)
+        if not_modified:
+            self.cache.record('not_modified')
+            content = await run_blocking(self.cache.body, url) if cached_body else None
+            if cached_body and content is None:
+                raise RuntimeError("304 但缓存内容已丢失")
+        else:
+            self.stats['bytes'] += len(content)
+            if self.cache is not None:
+                self.cache.record('fetched')
+        return content, headers, not_modified
+
+    def host_rates(self):
+        """各域名当前的限速速率（次/秒）及响应计数，用于调整抓取窗口"""
+        return {host: {'rate': round(throttle.rate, 2), **throttle.counters}
+                for host, throttle in self._hosts.items()}
+
+    def _report_rates(self):
+        self.stats['host_rates'] = self.host_rates()
+        for host, info in self.stats['host_rates'].items():
+            print(f"[RATE] {host}: {info['rate']:.2f} 次/秒（正常 {info['ok']}，慢 {info['slow']}，"
+                  f"限流 {info['throttled']}，错误 {info['errors']}，减速 {info['decreases']} 次）")
+
+    def _mark(self, page, status, records=0, error=None):
+        if status == PAGE_DONE:
+            self._pages_done.add(page)
+        if self.run_id is not None:
+            mark_page(self.run_id, page, status, records, error)
+
+    async def crawl_page(self, page):
+        """处理一个列表页，超时只计抓取、解析、入库这一段（不含等待页面名额）；
+        超时前已解析出的图片照常交给下载池"""
+        images = []
+        # 同时处理的页面数不超过全局并发数，增量模式下停止判断才能及时生效
+        async with self._page_semaphore:
+            try:
+                if await asyncio.wait_for(self._crawl_page(page, images), timeout=self.page_timeout):
+                    self.stats['pages'] += 1
+            except asyncio.TimeoutError:
+                if page in self._pages_done:
+                    # 记录已入库，只是收尾超时：仍算成功，不覆盖 done 状态
+                    self.stats['pages'] += 1
+                else:
+                    self.stats['pages_failed'] += 1
+                    print(f"页面处理超时（页码：{page}）")
+                    await run_blocking(self._mark, page, PAGE_FAILED, 0, "超时")
+        if self.with_images and images:
+            # 交给图片分发任务，不在页面阶段等待下载队列（背压只影响图片入队，不影响列表页解析）
+            self._image_feed.put_nowait(image_jobs(images))
+
+    async def image_feeder(self):
+        """图片分发：把各页面的图片任务依次放入下载队列，队列满时在此等待（背压）"""
+        while True:
+            jobs = await self._image_feed.get()
+            try:
+                for job in jobs:
+                    await self._download_queue.put(job)
+            finally:
+                self._image_feed.task_done()
+
+    async def _crawl_page(self, page, images):
+        """抓取、解析并入库一个列表页，解析出的图片追加到 images；页面处理成功返回 True"""
+        if self._stop_page is not None and page > self._stop_page:
+            self.stats['pages_skipped'] += 1
+            await run_blocking(self._mark, page, PAGE_SKIPPED)
+            return False
+        url = LIST_URL.format(page=page)
+        try:
+            (content, headers, not_modified), retries = await with_retries(
+                lambda: self.fetch(url), self.page_retries)
+            self.stats['retries'] += retries
+        except Exception as e:
+            self.stats['pages_failed'] += 1
+            print(f"页面请求失败（页码：{page}）: {e!r}")
+            await run_blocking(self._mark, page, PAGE_FAILED, 0, repr(e))
+            return False
+        if not_modified:
+            self.stats['not_modified'] += 1
+        elif self.cache is not None:
+            # 保存列表页响应体：下次可发条件请求，也供 --replay 离线解析
+            await run_blocking(self.cache.store, url, headers, content)
+        records, page_images = parse_list_page(decode_html(content))
+        images.extend(page_images)
+        if self.incremental and records:
+            new_records = await run_blocking(self._filter_new, records)
+            if not new_records:
+                # 整页都是已有车源：后面的页面不再抓取
+                print(f"第 {page} 页全部为已有车源，停止翻页")
+                if self._stop_page is None or page < self._stop_page:
+                    self._stop_page = page
+                await run_blocking(self._mark, page, PAGE_DONE)
+                return True
+            records = new_records
+        self.stats['records'] += len(records)
+        if records:
+            # 记录写入数据库后再标记页面完成；入库可能因背压阻塞，放到线程中执行
+            def on_written(ok):
+                self._mark(page, PAGE_DONE if ok else PAGE_FAILED, len(records), None if ok else "入库失败")
+            await run_blocking(store_records, records, self.writer, page, on_written)
+        else:
+            await run_blocking(self._mark, page, PAGE_DONE)
+        return True
+
+    async def download_worker(self):
+        """下载阶段：取 (链接, 文件名)，下载成功后把图片数据交给上传阶段；
+        图片返回 304（上次已上传成功且没有变化）时跳过上传。
+        还缺缩略图的图片（如生成缩略图之前上传的原图）不发条件请求，下载后补齐缩略图"""
+        while True:
+            link, name = await self._download_queue.get()
+            try:
+                conditional = not self._missing_variants(name)
+                (content, headers, not_modified), retries = await with_retries(
+                    lambda: self.fetch(link, cached_body=False, conditional=conditional), self.download_retries)
+                self.stats['retries'] += retries
+                if not_modified:
+                    self.stats['images_unchanged'] += 1
+                    continue
+                self.stats['images'] += 1
+                await self._upload_queue.put((name, content, link, headers))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['images_failed'] += 1
+                print(f"[ERR] {link}  ->  {e!r}")
+            finally:
+                self._download_queue.task_done()
+
+    async def upload_worker(self):
+        """上传阶段：直接从内存上传到七牛，不落盘；上传成功后才把图片登记到响应缓存"""
+        while True:
+            name, content, link, headers = await self._upload_queue.get()
+            try:
+                action, retries = await with_retries(
+                    lambda: self._upload(content, f"car_images/{name}"), self.upload_retries)
+                self.stats['retries'] += retries
+                if action == IMAGE_SKIPPED:
+                    self.stats['uploads_skipped'] += 1
+                elif action == IMAGE_COPIED:
+                    self.stats['uploads_copied'] += 1
+                    print(f"[UPL] {name} -> 七牛云复制成功（内容重复）")
+                else:
+                    self.stats['uploads'] += 1
+                    print(f"[UPL] {name} -> 七牛云成功")
+                if self.with_variants:
+                    await self._upload_variants(name, content, action)
+                if self.cache is not None:
+                    await run_blocking(self.cache.store, link, headers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['uploads_failed'] += 1
+                print(f"[UPL_ERR] {name} -> 七牛云失败: {e}")
+            finally:
+                self._upload_queue.task_done()
+
+    async def _upload(self, content, key):
+        """上传一张图片，返回 IMAGE_SKIPPED/IMAGE_COPIED/IMAGE_UPLOADED；有图片清单时先按内容哈希去重"""
+        if self.manifest is not None:
+            action = await run_blocking(self.manifest.store, content, key, upload_bytes, copy_object)
+        else:
+            action = IMAGE_UPLOADED if await run_blocking(upload_bytes, content, key) else None
+        if action is None:
+            raise RuntimeError("上传未成功")
+        return action
+
+    def _missing_variants(self, name):
+        """图片清单中还没有该图片的全部缩略图（没有图片清单时无法判断，返回 False）"""
+        if not self.with_variants or self.manifest is None:
+            return False
+        return not all(map(self.manifest.has, _variant_keys(name)))
+
+    async def _upload_variants(self, name, content, action):
+        """生成并上传原图的各尺寸缩略图；原图未变且缩略图都已登记时跳过"""
+        keys = _variant_keys(name)
+        if action == IMAGE_SKIPPED and self.manifest is not None and all(map(self.manifest.has, keys)):
+            return
+        try:
+            variants = await run_blocking(thumbnails.make_variants, content)
+        except Exception as e:
+            self.stats['variants_failed'] += len(keys)
+            print(f"[THUMB_ERR] {name} -> 生成缩略图失败: {e}")
+            return
+        for size, fmt, data in variants:
+            key = variant_key(name, size, fmt)
+            try:
+                await with_retries(lambda: self._upload(data, key), self.upload_retries)
+                self.stats['variants'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['variants_failed'] += 1
+                print(f"[UPL_ERR] {key} -> 七牛云失败: {e}")
+
+    def _filter_new(self, records):
+        with get_conn() as conn:
+            return filter_new_records(conn, records)
+
+    def _open_session(self):
+        """初始化并发限制，返回共享的 aiohttp 客户端（调用方 async with 管理生命周期）"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._page_semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        return aiohttp.ClientSession(headers=HEADERS, timeout=timeout, connector=connector)
+
+    async def run(self, pages):
+        """抓取给定页码；页面全部处理完后等待下载、上传队列排空。
+        任务被取消时取消所有页面和流水线任务并关闭客户端"""
+        # 页面阶段到图片分发之间不限长度：只保存 (链接, 文件名)
+        self._image_feed = asyncio.Queue()
+        self._download_queue = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+        self._upload_queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        if self.with_images and self.with_variants and not thumbnails.available():
+            print("未安装 Pillow，不生成缩略图（页面使用原图）")
+            self.with_variants = False
+        start = time.perf_counter()
+        async with self._open_session() as session:
+            self._session = session
+            workers = [asyncio.create_task(self.image_feeder())]
+            workers += [asyncio.create_task(self.download_worker()) for _ in range(self.download_workers)]
+            workers += [asyncio.create_task(self.upload_worker()) for _ in range(self.upload_workers)]
+            tasks = [asyncio.create_task(self.crawl_page(page)) for page in pages]
+            try:
+                await asyncio.gather(*tasks)
+                await self._image_feed.join()
+                await self._download_queue.join()
+                await self._upload_queue.join()
+            finally:
+                for task in tasks + workers:
+                    task.cancel()
+                await asyncio.gather(*tasks, *workers, return_exceptions=True)
+        self.stats['elapsed'] = time.perf_counter() - start
+        elapsed = self.stats['elapsed'] or 1e-9
+        print(f"[CRAWL] 页面 {self.stats['pages']} 成功 / {self.stats['pages_failed']} 失败，"
+              f"图片 {self.stats['images']} 张下载 / {self.stats['uploads']} 张上传 / "
+              f"{self.stats['uploads_copied']} 张复制 / {self.stats['uploads_skipped']} 张跳过，"
+              f"缩略图 {self.stats['variants']} 张上传 / {self.stats['variants_failed']} 张失败，"
+              f"未变化 {self.stats['not_modified']} 页 / {self.stats['images_unchanged']} 张图片，"
+              f"重试 {self.stats['retries']} 次，{self.stats['pages'] / elapsed:.2f} 页/秒，"
+              f"{self.stats['bytes'] / elapsed / 1024:.1f} KB/秒")
+        self._report_rates()
+        return self.stats
+
+
+def crawl(pages, writer=None, **kwargs):
+    """同步入口：asyncio.run 一次完整抓取"""
+    return asyncio.run(AsyncCrawler(writer=writer, **kwargs).run(pages))
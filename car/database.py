@@ -1,35 +1,50 @@
 import pymysql
-import re
+from pymysql.constants import ER
+import threading
+import traceback
+import hashlib
+import json
+import weakref
+import time
+from collections import deque
+from parsing import parse_caryear, parse_price, parse_many, split_carname, OBFUSCATION_CHAR
+from analysis import apply_stats_delta, ensure_statistics, rebuild_statistics
 
+# 数据库连接配置
+DB_CONFIG = {
+    'host': 'localhost',
+    'port': 3306,
+    'user': 'root',
+    'passwd': '1234',
+    'charset': 'utf8mb4',
+    'connect_timeout': 10
+}
 
-def get_conn(db_name='car'):
-    """获取数据库连接，不存在则创建数据库"""
+# 连接池配置
+POOL_MAX_SIZE = 10          # 最大连接数（空闲 + 使用中）
+POOL_MAX_IDLE = 300         # 空闲连接最长保留秒数，超时关闭
+POOL_PING_INTERVAL = 30     # 空闲超过该秒数的连接在借出前做一次健康检查
+POOL_WAIT_TIMEOUT = 10      # 连接耗尽时最长等待秒数
+POOL_LEAK_TIMEOUT = 60      # 借出超过该秒数未归还视为泄漏
+
+# 规范化解析规则版本：解析规则修正后加 1，init_table 时重新解析受影响的旧数据
+# （2：价格、年份/里程中的 U+E000 干扰字符先去掉再解析）
+NORMALIZE_VERSION = 2
+
+
+def _connect(db_name='car'):
+    """建立一个新的数据库连接，不存在则创建数据库"""
     try:
-        return pymysql.connect(
-            host='localhost',
-            port=3306,
-            user='root',
-            passwd='1234',
-            db=db_name,
-            charset='utf8mb4',
-            connect_timeout=10
-        )
+        return pymysql.connect(db=db_name, **DB_CONFIG)
     except pymysql.err.OperationalError as e:
         if "Unknown database" in str(e):
             try:
                 # 先连接默认数据库创建新库
-                temp_conn = pymysql.connect(
-                    host='localhost',
-                    port=3306,
-                    user='root',
-                    passwd='1234',
-                    charset='utf8mb4',
-                    connect_timeout=10
-                )
+                temp_conn = pymysql.connect(**DB_CONFIG)
                 create_database(temp_conn, db_name)
                 temp_conn.close()
                 # 再次尝试连接
-                return get_conn(db_name)
+                return pymysql.connect(db=db_name, **DB_CONFIG)
             except pymysql.err.OperationalError as conn_err:
                 print(f"数据库连接失败: {conn_err}")
                 raise conn_err
@@ -38,6 +53,270 @@ def get_conn(db_name='car'):
             raise e
 
 
+class PooledConnection:
+    """连接池借出的连接代理，close() 或 with 块结束时归还连接池"""
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+        self.checkout_at = time.monotonic()
+        self.checkout_stack = traceback.format_stack(limit=8)[:-2]
+        self.leak_reported = False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._conn is None:
+            raise pymysql.err.InterfaceError(0, "连接已归还连接池")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """归还连接（可重复调用）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool._release(self, conn)
+
+    def discard(self):
+        """关闭底层连接而不归还（如流式读取中途放弃，剩余结果集不值得读完）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool._discard(self, conn)
+
+    def __del__(self):
+        # 借出后未归还就被回收：记为泄漏并把连接还回连接池
+        if getattr(self, '_conn', None) is not None:
+            self._pool._report_leak(self, "连接未归还即被回收")
+            self.close()
+
+
+class ConnectionPool:
+    """线程安全的有界连接池：借出时健康检查、空闲超时淘汰、泄漏检测"""
+
+    def __init__(self, db_name='car', max_size=POOL_MAX_SIZE, max_idle=POOL_MAX_IDLE,
+                 ping_interval=POOL_PING_INTERVAL, wait_timeout=POOL_WAIT_TIMEOUT,
+                 leak_timeout=POOL_LEAK_TIMEOUT):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self.wait_timeout = wait_timeout
+        self.leak_timeout = leak_timeout
+        self._idle = deque()        # (原始连接, 归还时间)，后进先出
+        self._in_use = weakref.WeakSet()  # 借出中的 PooledConnection（弱引用，丢弃即可触发泄漏回收）
+        self._size = 0              # 已建立的连接总数
+        self._cond = threading.Condition()
+        self._counters = {
+            'checkouts': 0,
+            'created': 0,
+            'closed': 0,
+            'health_check_failed': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'leaks': 0
+        }
+
+    def get(self):
+        """借出一个连接，连接耗尽时阻塞等待"""
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            self._evict_idle()
+            while True:
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    raw, last_used = None, None
+                    self._size += 1
+                    break
+                self._check_leaks()
+                remaining = self.wait_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise pymysql.err.OperationalError(
+                        0, f"等待数据库连接超时（{self.wait_timeout}秒，使用中 {len(self._in_use)}）")
+                waited = True
+                self._cond.wait(remaining)
+
+        try:
+            if raw is None:
+                raw = self._new_raw()
+            elif time.monotonic() - last_used > self.ping_interval and not self._is_alive(raw):
+                self._counters['health_check_failed'] += 1
+                self._close_raw(raw)
+                raw = self._new_raw()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        conn = PooledConnection(self, raw)
+        with self._cond:
+            wait_time = time.monotonic() - start
+            self._counters['checkouts'] += 1
+            if waited:
+                self._counters['waits'] += 1
+            self._counters['wait_time_total'] += wait_time
+            self._counters['wait_time_max'] = max(self._counters['wait_time_max'], wait_time)
+            self._in_use.add(conn)
+        return conn
+
+    def connection(self):
+        """上下文管理器用法：with pool.connection() as conn: ..."""
+        return self.get()
+
+    def stats(self):
+        """连接池计数器：使用中/空闲连接数、等待时间、泄漏次数等"""
+        with self._cond:
+            data = dict(self._counters)
+            data['in_use'] = len(self._in_use)
+            data['idle'] = len(self._idle)
+            data['size'] = self._size
+            data['max_size'] = self.max_size
+            data['wait_time_avg'] = (data['wait_time_total'] / data['checkouts']) if data['checkouts'] else 0.0
+            return data
+
+    def close_all(self):
+        """关闭全部空闲连接（使用中的连接归还时再关闭）"""
+        with self._cond:
+            while self._idle:
+                raw, _ = self._idle.pop()
+                self._size -= 1
+                self._close_raw(raw)
+
+    def _release(self, conn, raw):
+        with self._cond:
+            self._in_use.discard(conn)
+        try:
+            # 结束可能未提交的事务，避免下一个使用者读到旧快照
+            raw.rollback()
+            reusable = raw.open
+        except Exception:
+            reusable = False
+        with self._cond:
+            if reusable:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._size -= 1
+                self._close_raw(raw)
+            self._cond.notify()
+
+    def _discard(self, conn, raw):
+        with self._cond:
+            self._in_use.discard(conn)
+            self._size -= 1
+            self._close_raw(raw)
+            self._cond.notify()
+
+    def _new_raw(self):
+        raw = _connect(self.db_name)
+        self._counters['created'] += 1
+        return raw
+
+    def _is_alive(self, raw):
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close_raw(self, raw):
+        self._counters['closed'] += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        """关闭空闲超过 max_idle 的连接（调用方持有锁）"""
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            raw, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_raw(raw)
+
+    def _check_leaks(self):
+        """连接耗尽时检查借出过久的连接（调用方持有锁）"""
+        now = time.monotonic()
+        for conn in list(self._in_use):
+            if now - conn.checkout_at > self.leak_timeout and not conn.leak_reported:
+                conn.leak_reported = True
+                self._report_leak(conn, f"借出超过 {self.leak_timeout} 秒未归还")
+
+    def _report_leak(self, conn, reason):
+        self._counters['leaks'] += 1
+        print(f"[POOL] 疑似连接泄漏（{reason}），借出位置:\n{''.join(conn.checkout_stack)}")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name='car'):
+    """获取（必要时创建）指定数据库的连接池"""
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = _pools[db_name] = ConnectionPool(db_name)
+    return pool
+
+
+def get_conn(db_name='car'):
+    """从连接池借出数据库连接，不存在则创建数据库；用 with 或 close() 归还"""
+    return get_pool(db_name).get()
+
+
+def pool_stats(db_name='car'):
+    """返回连接池计数器"""
+    return get_pool(db_name).stats()
+
+
+def normalize_car(carname, carmoney, caryear):
+    """把原始字符串解析成类型化字段：brand, model, price_wan, reg_year, mileage_km"""
+    brand, model = split_carname(carname)
+    reg_year, mileage_km = parse_caryear(caryear)
+    return {
+        'brand': brand[:64] if brand else None,
+        'model': model[:191] if model else None,
+        'price_wan': parse_price(carmoney),
+        'reg_year': reg_year,
+        'mileage_km': mileage_km
+    }
+
+
+def car_rows_to_dicts(rows):
+    """把查询结果行批量转换为页面使用的车辆字典
+
+    优先使用规范化字段；旧数据未回填时由 parse_many 解析 caryear 兜底
+    """
+    cars = []
+    for row, parsed in zip(rows, parse_many(rows)):
+        car = {
+            'id': row['id'],
+            'brand': row['brand'] or "未知品牌",
+            'model': row['model'] or "未知型号",
+            'price': row['carmoney'],
+            'name': row['carname'],
+            'year': parsed['year_display'],
+            'mileage': parsed['mileage_display']
+        }
+        if 'price_wan' in row:
+            car['price_label'] = price_label(row['price_wan'])
+        cars.append(car)
+    return cars
+
+
 def create_database(conn, db_name):
     """创建数据库"""
     try:
@@ -51,7 +330,7 @@ def create_database(conn, db_name):
 
 
 def init_table(conn):
-    """初始化数据表（包含caryear字段）"""
+    """初始化数据表（包含caryear字段及规范化字段）"""
     try:
         with conn.cursor() as cursor:
             create_sql = """
@@ -60,10 +339,56 @@ def init_table(conn):
                 carname VARCHAR(255) NOT NULL,
                 carmoney VARCHAR(100) NOT NULL,
                 caryear VARCHAR(100) NOT NULL,  # 新增年份+里程字段
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                brand VARCHAR(64) NULL,
+                model VARCHAR(191) NULL,
+                price_wan DECIMAL(10,2) NULL,
+                reg_year SMALLINT NULL,
+                mileage_km INT NULL,
+                infoid BIGINT NULL,  # 车源ID（列表页 li 的 infoid 属性）
+                dealerid BIGINT NULL,
+                content_hash CHAR(40) NULL,  # 车名+价格+年份里程的哈希，用于跳过未变化的车源
+                prev_carmoney VARCHAR(100) NULL,
+                price_changed_at TIMESTAMP NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_brand (brand),
+                INDEX idx_price_wan (price_wan),
+                INDEX idx_reg_year (reg_year),
+                INDEX idx_mileage_km (mileage_km),
+                UNIQUE INDEX uk_infoid (infoid),
+                INDEX idx_updated_at (updated_at)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
             cursor.execute(create_sql)
+
+            # 目录元数据表：保存入库时维护的计数等（避免每次请求 COUNT(*)）
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                name VARCHAR(64) PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
+            cursor.execute("""
+            INSERT IGNORE INTO catalog_meta (name, value)
+            SELECT 'total_count', COUNT(*) FROM carprice
+            """)
+            # 数据版本：每次入库有变化时加 1，用于 ETag 和进程内缓存失效
+            cursor.execute("INSERT IGNORE INTO catalog_meta (name, value) VALUES ('data_version', 1)")
+
+            # 详情页参数表：常用参数单独成列，全部标签/值保存在 attrs
+            detail_columns = "".join(f"{column} VARCHAR(64) NULL,\n" for _, column in DETAIL_FIELDS)
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS car_detail_attrs (
+                infoid BIGINT PRIMARY KEY,
+                dealerid BIGINT NULL,
+                {detail_columns}
+                attrs JSON NOT NULL,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                attempts INT NOT NULL DEFAULT 0,  # 连续抓取失败（或无参数）次数
+                next_try_at TIMESTAMP NULL  # 失败后下次重试时间，成功后清空
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
             
             # 创建用户表
             create_user_table_sql = """
@@ -87,99 +412,709 @@ def init_table(conn):
     except Exception as e:
         print(f"初始化表失败: {e}")
         conn.rollback()
+    # 旧表补齐规范化字段和索引
+    migrate_carprice(conn)
+    migrate_detail_attrs(conn)
+    # 统计汇总表（旧库升级时自动全量重建）
+    try:
+        ensure_statistics(conn)
+    except Exception as e:
+        print(f"初始化统计汇总表失败: {e}")
+        conn.rollback()
+    # 解析规则修正后重新解析旧数据
+    try:
+        upgrade_normalized(conn)
+    except Exception as e:
+        print(f"升级规范化字段失败: {e}")
+        conn.rollback()
+
+
+def migrate_detail_attrs(conn):
+    """为旧版 car_detail_attrs 表补齐重试记录字段（可重复执行）"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'car_detail_attrs'
+            """)
+            columns = {row[0] for row in cursor.fetchall()}
+            alters = [f"ADD COLUMN {name} {ddl}" for name, ddl in DETAIL_ATTRS_COLUMNS if name not in columns]
+            if not alters:
+                return False
+            cursor.execute(f"ALTER TABLE car_detail_attrs {', '.join(alters)}")
+            conn.commit()
+            print(f"car_detail_attrs 表迁移完成: {len(alters)} 项变更")
+            return True
+    except Exception as e:
+        print(f"迁移详情参数表失败: {e}")
+        conn.rollback()
+        return False
+
+
+# 规范化字段、车源标识及其二级索引（用于旧表迁移）
+CARPRICE_COLUMNS = [
+    ('brand', 'VARCHAR(64) NULL'),
+    ('model', 'VARCHAR(191) NULL'),
+    ('price_wan', 'DECIMAL(10,2) NULL'),
+    ('reg_year', 'SMALLINT NULL'),
+    ('mileage_km', 'INT NULL'),
+    ('infoid', 'BIGINT NULL'),
+    ('dealerid', 'BIGINT NULL'),
+    ('content_hash', 'CHAR(40) NULL'),
+    ('prev_carmoney', 'VARCHAR(100) NULL'),
+    ('price_changed_at', 'TIMESTAMP NULL'),
+    ('updated_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP')
+]
+CARPRICE_INDEXES = [
+    ('idx_brand', 'INDEX idx_brand (brand)'),
+    ('idx_price_wan', 'INDEX idx_price_wan (price_wan)'),
+    ('idx_reg_year', 'INDEX idx_reg_year (reg_year)'),
+    ('idx_mileage_km', 'INDEX idx_mileage_km (mileage_km)'),
+    ('uk_infoid', 'UNIQUE INDEX uk_infoid (infoid)'),
+    ('idx_updated_at', 'INDEX idx_updated_at (updated_at)')
+]
+DETAIL_ATTRS_COLUMNS = [
+    ('attempts', 'INT NOT NULL DEFAULT 0'),
+    ('next_try_at', 'TIMESTAMP NULL')
+]
+
+
+def migrate_carprice(conn):
+    """为旧版 carprice 表补齐规范化字段和索引（可重复执行）"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'carprice'
+            """)
+            columns = {row[0] for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'carprice'
+            """)
+            indexes = {row[0] for row in cursor.fetchall()}
+
+            alters = [f"ADD COLUMN {name} {ddl}" for name, ddl in CARPRICE_COLUMNS if name not in columns]
+            alters += [f"ADD {ddl}" for name, ddl in CARPRICE_INDEXES if name not in indexes]
+            if not alters:
+                return False
+            cursor.execute(f"ALTER TABLE carprice {', '.join(alters)}")
+            conn.commit()
+            print(f"carprice 表迁移完成: {len(alters)} 项变更")
+    except Exception as e:
+        print(f"迁移表结构失败: {e}")
+        conn.rollback()
+        return False
+    # 新增字段后回填已有数据
+    backfill_normalized(conn)
+    return True
+
+
+def backfill_normalized(conn, batch_size=1000, obfuscated=False):
+    """一次性回填旧数据的规范化字段（按主键分批，brand 为空视为未处理），返回回填条数，失败返回 None
+
+    obfuscated=True 时改为重新解析价格或年份/里程中含 U+E000 干扰字符的行
+    """
+    total = 0
+    last_id = 0
+    if obfuscated:
+        # 按二进制比较，避免排序规则把私有区字符当作可忽略字符
+        condition = "(INSTR(carmoney COLLATE utf8mb4_bin, %s) > 0 OR INSTR(caryear COLLATE utf8mb4_bin, %s) > 0)"
+        condition_params = (OBFUSCATION_CHAR, OBFUSCATION_CHAR)
+    else:
+        condition = "brand IS NULL"
+        condition_params = ()
+    sql = """
+        UPDATE carprice SET brand = %s, model = %s, price_wan = %s, reg_year = %s, mileage_km = %s
+        WHERE id = %s
+    """
+    try:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            while True:
+                cursor.execute(f"""
+                    SELECT id, carname, carmoney, caryear FROM carprice
+                    WHERE id > %s AND {condition}
+                    ORDER BY id LIMIT %s
+                """, (last_id, *condition_params, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                params = []
+                for row in rows:
+                    fields = normalize_car(row['carname'], row['carmoney'], row['caryear'])
+                    params.append((fields['brand'] or '', fields['model'], fields['price_wan'],
+                                   fields['reg_year'], fields['mileage_km'], row['id']))
+                cursor.executemany(sql, params)
+                bump_data_version(cursor)
+                conn.commit()
+                total += len(rows)
+                last_id = rows[-1]['id']
+        print(f"回填规范化字段 {total} 条")
+    except Exception as e:
+        conn.rollback()
+        print(f"回填规范化字段失败: {e}")
+        return None
+    return total
 
 
-def save_data(conn, carname_list, carmoney_list, caryear_list=None):
-    """保存数据到数据库，支持caryear字段"""
+def upgrade_normalized(conn):
+    """规范化解析规则版本低于 NORMALIZE_VERSION 时，重新解析含干扰字符的旧数据并重建统计汇总表
+
+    完成后把版本写入 catalog_meta，之后启动不再重复；返回是否执行了升级
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT value FROM catalog_meta WHERE name = 'normalize_version'")
+        row = cursor.fetchone()
+    conn.commit()
+    if row and row[0] >= NORMALIZE_VERSION:
+        return False
+    fixed = backfill_normalized(conn, obfuscated=True)
+    if fixed is None:
+        return False
+    if fixed and not rebuild_statistics(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO catalog_meta (name, value) VALUES ('normalize_version', %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value)
+        """, (NORMALIZE_VERSION,))
+    conn.commit()
+    return True
+
+
+# 并发写入同一车源（如车源在爬取过程中换页、多个写线程）时，唯一键冲突或死锁整批回滚后重试的次数
+SAVE_CONFLICT_RETRIES = 3
+_SAVE_CONFLICTS = (ER.DUP_ENTRY, ER.LOCK_DEADLOCK)
+
+
+def content_hash(carname, carmoney, caryear):
+    """车源内容哈希：任一展示字段变化都会改变哈希"""
+    return hashlib.sha1(f"{carname}\x1f{carmoney}\x1f{caryear}".encode('utf-8')).hexdigest()
+
+
+def save_data(conn, carname_list, carmoney_list, caryear_list=None, infoid_list=None, dealerid_list=None):
+    """保存数据到数据库：按 infoid 插入或更新，内容未变化的车源跳过写入
+
+    返回实际插入和更新的条数（全部未变化时为 0），写入失败返回 None。
+    没有 infoid 的记录（旧数据源）直接插入
+    """
     if not carname_list or not carmoney_list:
-        return
+        return 0
 
     caryear_list = caryear_list or []
     min_length = min(len(carname_list), len(carmoney_list), len(caryear_list))
-    carname_list = carname_list[:min_length]
-    carmoney_list = carmoney_list[:min_length]
-    caryear_list = caryear_list[:min_length]
+    infoid_list = list(infoid_list or [])[:min_length]
+    dealerid_list = list(dealerid_list or [])[:min_length]
+    infoid_list += [None] * (min_length - len(infoid_list))
+    dealerid_list += [None] * (min_length - len(dealerid_list))
 
-    # 插入包含caryear的记录
-    sql = "INSERT INTO carprice(carname, carmoney, caryear) VALUES (%s, %s, %s)"
+    # 同一批中重复出现的车源只保留最后一次
+    rows = {}
+    for i in range(min_length):
+        key = infoid_list[i] if infoid_list[i] is not None else ('row', i)
+        rows[key] = (carname_list[i], carmoney_list[i], caryear_list[i], infoid_list[i], dealerid_list[i])
 
-    with conn.cursor() as cur:
+    for attempt in range(SAVE_CONFLICT_RETRIES):
         try:
-            data = zip(carname_list, carmoney_list, caryear_list)
-            cur.executemany(sql, data)
-            conn.commit()
-            print(f"插入 {cur.rowcount} 条数据")
+            return _save_rows(conn, rows)
         except Exception as e:
             conn.rollback()
+            # 其他写入者同时插入或锁住了同一车源：重新读取已有车源后整批重试（统计增量按新读到的旧值计算）
+            conflict = isinstance(e, pymysql.err.MySQLError) and e.args and e.args[0] in _SAVE_CONFLICTS
+            if conflict and attempt < SAVE_CONFLICT_RETRIES - 1:
+                print(f"写入冲突，重试（第 {attempt + 1} 次）: {e}")
+                continue
             print(f"插入失败: {e}")
+            return None
+
+
+def _save_rows(conn, rows):
+    """在一个事务中写入去重后的车源 {key: 记录}，返回插入和更新的条数；出错时由调用方回滚"""
+    insert_sql = """
+        INSERT INTO carprice(carname, carmoney, caryear, brand, model, price_wan, reg_year, mileage_km,
+                             infoid, dealerid, content_hash)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    # 旧价格和是否变价由 Python 根据已查出的旧行传入：MySQL 按从左到右执行 SET，
+    # 在 SET 中引用 carmoney 时可能已经是新值
+    update_sql = """
+        UPDATE carprice
+        SET carname = %s, carmoney = %s, caryear = %s, brand = %s, model = %s, price_wan = %s,
+            reg_year = %s, mileage_km = %s, dealerid = %s, content_hash = %s,
+            prev_carmoney = IF(%s, %s, prev_carmoney),
+            price_changed_at = IF(%s, NOW(), price_changed_at)
+        WHERE id = %s
+    """
+
+    with conn.cursor(pymysql.cursors.DictCursor) as cur:
+        # 已有车源：按 infoid 查出旧的哈希和统计字段，并锁定到提交，避免并发写入重复扣减统计
+        existing = {}
+        infoids = [key for key in rows if not isinstance(key, tuple)]
+        if infoids:
+            placeholders = ", ".join(["%s"] * len(infoids))
+            cur.execute(f"""
+                SELECT id, infoid, carmoney, content_hash, brand, price_wan, reg_year, mileage_km
+                FROM carprice WHERE infoid IN ({placeholders})
+                FOR UPDATE
+            """, infoids)
+            existing = {row['infoid']: row for row in cur.fetchall()}
+
+        inserts, updates = [], []
+        added, removed = [], []
+        unchanged = price_changed = 0
+        for carname, carmoney, caryear, infoid, dealerid in rows.values():
+            digest = content_hash(carname, carmoney, caryear)
+            old = existing.get(infoid)
+            if old is not None and old['content_hash'] == digest:
+                unchanged += 1
+                continue
+            fields = normalize_car(carname, carmoney, caryear)
+            values = (carname, carmoney, caryear, fields['brand'] or '', fields['model'],
+                      fields['price_wan'], fields['reg_year'], fields['mileage_km'])
+            added.append(fields)
+            if old is None:
+                inserts.append(values + (infoid, dealerid, digest))
+            else:
+                changed = old['carmoney'] != carmoney
+                updates.append(values + (dealerid, digest, changed, old['carmoney'], changed, old['id']))
+                removed.append(old)
+                if changed:
+                    price_changed += 1
+
+        if inserts:
+            cur.executemany(insert_sql, inserts)
+        if updates:
+            cur.executemany(update_sql, updates)
+        # 与写入同一事务维护总数和统计汇总表（更新的车源先扣减旧值再累加新值）
+        cur.execute("UPDATE catalog_meta SET value = value + %s WHERE name = 'total_count'", (len(inserts),))
+        apply_stats_delta(cur, removed, sign=-1)
+        apply_stats_delta(cur, added)
+        if inserts or updates:
+            bump_data_version(cur)
+        conn.commit()
+        invalidate_total_count()
+        invalidate_data_version()
+        print(f"插入 {len(inserts)} 条，更新 {len(updates)} 条（价格变化 {price_changed} 条），未变化 {unchanged} 条")
+        return len(inserts) + len(updates)
+
+
+def filter_new_records(conn, records):
+    """返回 records 中库里还没有或内容已变化的记录（按 infoid + 内容哈希判断）
+
+    records 为 (carname, carmoney, caryear, infoid, dealerid)
+    """
+    infoids = list({record[3] for record in records if record[3] is not None})
+    if not infoids:
+        return list(records)
+    placeholders = ", ".join(["%s"] * len(infoids))
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT infoid, content_hash FROM carprice
+            WHERE infoid IN ({placeholders})
+        """, infoids)
+        known = dict(cursor.fetchall())
+    return [record for record in records
+            if record[3] is None or known.get(record[3]) != content_hash(*record[:3])]
+
+
+# 详情页（.basic-item-ul 中的标签）-> car_detail_attrs 列
+DETAIL_FIELDS = [
+    ('上牌时间', 'reg_date'),
+    ('表显里程', 'mileage_text'),
+    ('变速箱', 'gearbox'),
+    ('排放标准', 'emission_standard'),
+    ('排量', 'displacement'),
+    ('发布时间', 'published'),
+    ('年检到期', 'inspection_due'),
+    ('保险到期', 'insurance_due'),
+    ('质保到期', 'warranty_due'),
+    ('过户次数', 'transfer_count'),
+    ('所在地', 'location'),
+    ('发动机', 'engine'),
+    ('车辆级别', 'car_level'),
+    ('车身颜色', 'body_color'),
+    ('燃油标号', 'fuel_grade'),
+    ('驱动方式', 'drive_mode'),
+]
+
+DETAIL_RETRY_HOURS = 6              # 详情页抓取失败或无参数后的首次重试间隔（小时），之后每次翻倍
+DETAIL_RETRY_MAX_HOURS = 24 * 7     # 重试间隔上限（小时），已下架的车源每周最多再试一次
+
+
+def pending_detail_targets(conn, limit=1000):
+    """还没有详情参数、或列表信息在上次抓取详情后有变化的车源 [(infoid, dealerid), ...]
+
+    上次抓取失败或无参数的车源（见 record_detail_failures）到了重试时间才再次选出
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.infoid, c.dealerid FROM carprice c
+            LEFT JOIN car_detail_attrs d ON d.infoid = c.infoid
+            WHERE c.infoid IS NOT NULL AND c.dealerid IS NOT NULL
+              AND (d.infoid IS NULL
+                   OR (d.next_try_at IS NULL AND d.fetched_at < c.updated_at)
+                   OR d.next_try_at <= NOW())
+            ORDER BY c.id
+            LIMIT %s
+        """, (limit,))
+        return list(cursor.fetchall())
+
+
+def save_detail_attrs(conn, details):
+    """批量写入详情参数 [(infoid, dealerid, {标签: 值}), ...]，按 infoid 覆盖，返回写入条数"""
+    if not details:
+        return 0
+    columns = [column for _, column in DETAIL_FIELDS]
+    placeholders = ", ".join(["%s"] * (len(columns) + 3))
+    updates = ", ".join(f"{column} = VALUES({column})" for column in ['dealerid'] + columns + ['attrs'])
+    sql = f"""
+        INSERT INTO car_detail_attrs (infoid, dealerid, {", ".join(columns)}, attrs)
+        VALUES ({placeholders})
+        ON DUPLICATE KEY UPDATE {updates}, fetched_at = CURRENT_TIMESTAMP, attempts = 0, next_try_at = NULL
+    """
+    rows = []
+    for infoid, dealerid, attrs in details:
+        values = [(attrs.get(label) or '')[:64] or None for label, _ in DETAIL_FIELDS]
+        rows.append((infoid, dealerid, *values, json.dumps(attrs, ensure_ascii=False)))
+    try:
+        with conn.cursor() as cursor:
+            cursor.executemany(sql, rows)
+            bump_data_version(cursor)
+        conn.commit()
+        invalidate_data_version()
+        return len(rows)
+    except Exception as e:
+        conn.rollback()
+        print(f"写入详情参数失败: {e}")
+        return 0
+
+
+def record_detail_failures(conn, targets):
+    """记录抓取失败或无参数的详情页 [(infoid, dealerid), ...]：失败次数加 1，
+    按次数指数推迟下次重试时间；已有的详情参数保留。返回记录条数"""
+    if not targets:
+        return 0
+    # 同一语句中 attempts 已先加 1，attempts - 1 为之前的失败次数
+    sql = """
+        INSERT INTO car_detail_attrs (infoid, dealerid, attrs, attempts, next_try_at)
+        VALUES (%s, %s, '{}', 1, NOW() + INTERVAL %s HOUR)
+        ON DUPLICATE KEY UPDATE
+            attempts = attempts + 1,
+            next_try_at = NOW() + INTERVAL LEAST(%s << LEAST(attempts - 1, 16), %s) HOUR
+    """
+    rows = [(infoid, dealerid, DETAIL_RETRY_HOURS, DETAIL_RETRY_HOURS, DETAIL_RETRY_MAX_HOURS)
+            for infoid, dealerid in targets]
+    try:
+        with conn.cursor() as cursor:
+            cursor.executemany(sql, rows)
+        conn.commit()
+        return len(rows)
+    except Exception as e:
+        conn.rollback()
+        print(f"记录详情页失败次数失败: {e}")
+        return 0
+
+
+def get_detail_attrs(conn, infoid):
+    """车源的详情参数字典（标签 -> 值），没有抓取过时返回空字典"""
+    if infoid is None:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT attrs FROM car_detail_attrs WHERE infoid = %s", (infoid,))
+        row = cursor.fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+# 总数缓存：读取 catalog_meta 中入库维护的计数，进程内再缓存一小段时间
+TOTAL_COUNT_TTL = 30
+_total_count_cache = {'value': None, 'expires': 0.0}
+_total_count_lock = threading.Lock()
+
+
+def get_total_count(conn):
+    """获取 carprice 总数（读缓存值，不做 COUNT(*)）"""
+    with _total_count_lock:
+        if _total_count_cache['value'] is not None and time.monotonic() < _total_count_cache['expires']:
+            return _total_count_cache['value']
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT value FROM catalog_meta WHERE name = 'total_count'")
+        row = cursor.fetchone()
+    # 计数行缺失（如旧库未初始化）时重新统计
+    total = row[0] if row else refresh_total_count(conn)
+    with _total_count_lock:
+        _total_count_cache['value'] = total
+        _total_count_cache['expires'] = time.monotonic() + TOTAL_COUNT_TTL
+    return total
+
+
+def refresh_total_count(conn):
+    """全量重算总数并写回 catalog_meta（用于恢复）"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM carprice")
+        total = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO catalog_meta (name, value) VALUES ('total_count', %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value)
+        """, (total,))
+    conn.commit()
+    invalidate_total_count()
+    return total
+
+
+def invalidate_total_count():
+    """清除进程内的总数缓存"""
+    with _total_count_lock:
+        _total_count_cache['value'] = None
+
+
+# 数据版本：catalog_meta 中的 data_version，入库有变化时在同一事务内加 1。
+# Web 进程缓存一小段时间，据此生成 ETag、让进程内缓存失效，304 判断不必每次查库
+DATA_VERSION_TTL = 5
+_data_version_cache = {'value': None, 'expires': 0.0}
+_data_version_lock = threading.Lock()
+_data_version_listeners = []
+
+
+def bump_data_version(cursor):
+    """数据版本加 1（由调用方在写入事务内提交）"""
+    cursor.execute("UPDATE catalog_meta SET value = value + 1 WHERE name = 'data_version'")
+
+
+def get_data_version(conn=None):
+    """当前数据版本（进程内缓存 DATA_VERSION_TTL 秒）；版本变化时通知 on_data_version_change 注册的回调"""
+    with _data_version_lock:
+        cached = _data_version_cache['value']
+        if cached is not None and time.monotonic() < _data_version_cache['expires']:
+            return cached
+    if conn is None:
+        with get_conn() as conn:
+            return get_data_version(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT value FROM catalog_meta WHERE name = 'data_version'")
+        row = cursor.fetchone()
+    version = row[0] if row else 0
+    with _data_version_lock:
+        _data_version_cache['value'] = version
+        _data_version_cache['expires'] = time.monotonic() + DATA_VERSION_TTL
+    if cached is not None and version != cached:
+        invalidate_total_count()
+        for callback in list(_data_version_listeners):
+            try:
+                callback(version)
+            except Exception as e:
+                print(f"数据版本回调出错: {e}")
+    return version
+
+
+def on_data_version_change(callback):
+    """注册数据版本变化回调 callback(新版本)，供进程内缓存失效"""
+    _data_version_listeners.append(callback)
+    return callback
+
+
+def invalidate_data_version():
+    """清除进程内的数据版本缓存（本进程写入后立即生效）"""
+    with _data_version_lock:
+        _data_version_cache['expires'] = 0.0
 
 
 def read_data(conn, page=1, per_page=24):
-    """分页读取数据（包含caryear字段）"""
+    """分页读取数据（偏移分页，按 id 排序保证顺序稳定）"""
     cars = []
     total_count = 0
     try:
+        total_count = get_total_count(conn)
         with conn.cursor(pymysql.cursors.DictCursor) as cursor:
-            # 查询总记录数
-            cursor.execute("SELECT COUNT(*) AS total FROM carprice")
-            total_count = cursor.fetchone()['total']
-
-            # 分页查询（包含caryear）
+            # 分页查询（直接读取规范化字段）
             offset = (page - 1) * per_page
             cursor.execute("""
-                SELECT id, carname, carmoney, caryear 
+                SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, price_wan
                 FROM carprice 
+                ORDER BY id
                 LIMIT %s OFFSET %s
             """, (per_page, offset))
-            results = cursor.fetchall()
-
-            # 处理数据格式（解析年份和里程）
-            for row in results:
-                parts = row['carname'].split()
-                brand = parts[0] if parts else "未知品牌"
-                model = " ".join(parts[1:]) if len(parts) > 1 else "未知型号"
-
-                # 解析caryear（格式如：2023年/3.2万公里）
-                year = "未知"
-                mileage = "里程待询"
-                if row['caryear']:
-                    # 清理数据中的特殊字符
-                    clean_caryear = row['caryear'].replace('', '')  # 移除特殊字符
-                    
-                    # 提取年份
-                    year_match = re.search(r'(\d{4})年', clean_caryear)
-                    if year_match:
-                        year = year_match.group(1)
-                    
-                    # 提取里程
-                    mileage_match = re.search(r'([\d.]+万?)公[里里]', clean_caryear)
-                    if mileage_match:
-                        mileage = mileage_match.group(1) + "公里"
-                    elif re.search(r'(\d+\.?\d*)万?公[里里]', clean_caryear):
-                        mileage_match = re.search(r'(\d+\.?\d*)万?公[里里]', clean_caryear)
-                        if mileage_match:
-                            mileage = mileage_match.group(1) + "万公里"
-                    else:
-                        # 如果没有匹配到"万"字，尝试匹配普通数字
-                        mileage_match = re.search(r'(\d+\.?\d*)公[里里]', clean_caryear)
-                        if mileage_match:
-                            mileage = mileage_match.group(1) + "公里"
-                cars.append({
-                    'id': row['id'],
-                    'brand': brand,
-                    'model': model,
-                    'price': row['carmoney'],
-                    'name': row['carname'],
-                    'year': year,
-                    'mileage': mileage
-                })
+            cars = car_rows_to_dicts(cursor.fetchall())
+    except Exception as e:
+        print(f"读取数据失败: {e}")
+    return cars, total_count
+
+
+def read_data_seek(conn, after_id=None, before_id=None, per_page=24):
+    """游标分页读取数据：after_id 取下一页，before_id 取上一页
+
+    返回 (cars, total_count, prev_cursor, next_cursor)，游标为 None 表示没有上一页/下一页
+    """
+    cars = []
+    total_count = 0
+    prev_cursor = next_cursor = None
+    try:
+        total_count = get_total_count(conn)
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            # 多取一行用于判断是否还有更多数据
+            if before_id is not None:
+                cursor.execute("""
+                    SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, price_wan
+                    FROM carprice
+                    WHERE id < %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                """, (before_id, per_page + 1))
+                rows = cursor.fetchall()
+                has_more = len(rows) > per_page
+                rows = list(reversed(rows[:per_page]))
+                has_prev, has_next = has_more, True
+            else:
+                cursor.execute("""
+                    SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, price_wan
+                    FROM carprice
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id or 0, per_page + 1))
+                rows = cursor.fetchall()
+                has_next = len(rows) > per_page
+                rows = rows[:per_page]
+                has_prev = bool(after_id)
+            cars = car_rows_to_dicts(rows)
+            if cars:
+                prev_cursor = cars[0]['id'] if has_prev else None
+                next_cursor = cars[-1]['id'] if has_next else None
     except Exception as e:
         print(f"读取数据失败: {e}")
-    finally:
-        conn.close()
+    return cars, total_count, prev_cursor, next_cursor
+
+
+# 价格区间配置：左闭右开，单位"万元"
+PRICE_SEGMENTS = [
+    (0, 10, "经济实惠"),
+    (10, 20, "家用首选"),
+    (20, 30, "品质之选"),
+    (30, 50, "豪华舒适"),
+    (50, None, "高端定制")
+]
+PRICE_LABEL_INVALID = "价格异常"
+
+
+def price_label(price_wan):
+    """根据价格（万元）返回对应的价格区间标签"""
+    if price_wan is None or price_wan < 0:
+        return PRICE_LABEL_INVALID
+    for low, high, tag in PRICE_SEGMENTS:
+        if low <= price_wan and (high is None or price_wan < high):
+            return tag
+    return PRICE_LABEL_INVALID
+
+
+def _price_condition(category):
+    """把价格标签转换成 price_wan 上的范围条件，未知标签返回 None"""
+    if category == PRICE_LABEL_INVALID:
+        return "price_wan IS NULL", ()
+    for low, high, tag in PRICE_SEGMENTS:
+        if tag == category:
+            if high is None:
+                return "price_wan >= %s", (low,)
+            return "price_wan >= %s AND price_wan < %s", (low, high)
+    return None
+
+
+def read_data_by_price(conn, category='all', page=1, per_page=24):
+    """按价格区间分页读取数据（范围查询走 price_wan 索引，只取当前页）"""
+    if category == 'all':
+        cars, total_count = read_data(conn, page=page, per_page=per_page)
+    else:
+        cars = []
+        total_count = 0
+        condition = _price_condition(category)
+        if condition is None:
+            return cars, total_count
+        where, params = condition
+        try:
+            with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                cursor.execute(f"SELECT COUNT(*) AS total FROM carprice WHERE {where}", params)
+                total_count = cursor.fetchone()['total']
+
+                # 延迟关联：子查询只扫描索引拿到当前页 id，再回表取整行
+                offset = (page - 1) * per_page
+                cursor.execute(f"""
+                    SELECT c.id, c.carname, c.carmoney, c.caryear, c.brand, c.model, c.reg_year, c.mileage_km, c.price_wan
+                    FROM carprice c
+                    JOIN (
+                        SELECT id FROM carprice WHERE {where} ORDER BY id LIMIT %s OFFSET %s
+                    ) page_ids ON page_ids.id = c.id
+                    ORDER BY c.id
+                """, params + (per_page, offset))
+                cars = car_rows_to_dicts(cursor.fetchall())
+        except Exception as e:
+            print(f"读取数据失败: {e}")
     return cars, total_count
 
 
+def read_data_by_ids(conn, ids):
+    """按 id 列表读取车辆（主键查询），保持 ids 的顺序"""
+    if not ids:
+        return []
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"""
+            SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, price_wan
+            FROM carprice
+            WHERE id IN ({placeholders})
+        """, tuple(ids))
+        rows = {row['id']: row for row in cursor.fetchall()}
+    return car_rows_to_dicts([rows[car_id] for car_id in ids if car_id in rows])
+
+
+# 全量导出配置
+EXPORT_BATCH_SIZE = 1000        # 服务端游标每次取的行数
+EXPORT_COLUMNS = ('id', 'infoid', 'dealerid', 'carname', 'carmoney', 'caryear', 'brand', 'model',
+                  'price_wan', 'reg_year', 'mileage_km', 'updated_at')
+
+
+def export_filters(brand=None, price_category=None, min_price=None, max_price=None,
+                   min_year=None, max_year=None, updated_since=None):
+    """把导出筛选参数转换成 (where, params)，未知价格标签返回 None"""
+    conditions = []
+    params = []
+    if brand:
+        conditions.append("brand = %s")
+        params.append(brand)
+    if price_category and price_category != 'all':
+        condition = _price_condition(price_category)
+        if condition is None:
+            return None
+        conditions.append(condition[0])
+        params.extend(condition[1])
+    for column, op, value in (('price_wan', '>=', min_price), ('price_wan', '<', max_price),
+                              ('reg_year', '>=', min_year), ('reg_year', '<=', max_year),
+                              ('updated_at', '>=', updated_since)):
+        if value is not None:
+            conditions.append(f"{column} {op} %s")
+            params.append(value)
+    where = " AND ".join(conditions) if conditions else "1 = 1"
+    return where, tuple(params)
+
+
+def iter_export_rows(conn, where="1 = 1", params=(), batch_size=EXPORT_BATCH_SIZE):
+    """按 id 顺序流式读取车源，每次产出一批元组（列顺序同 EXPORT_COLUMNS）
+
+    使用服务端游标（SSCursor），结果集留在 MySQL 端按批 fetchmany，内存占用与表大小无关；
+    游标读完之前该连接不能执行其他语句，中途放弃时调用方应 discard() 连接
+    """
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(f"""
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM carprice
+        WHERE {where}
+        ORDER BY id
+    """, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+    cursor.close()
+
+
 def verify_user(conn, username, password):
     """验证用户凭据"""
     try:
@@ -223,3 +1158,13 @@ def check_username_exists(conn, username):
     except Exception as e:
         print(f"检查用户名时出错: {e}")
         return False
+
+
+if __name__ == '__main__':
+    # 一次性迁移：为旧表补齐规范化字段并回填数据
+    with get_conn() as conn:
+        init_table(conn)
+        backfill_normalized(conn)
+        backfill_normalized(conn, obfuscated=True)
+        refresh_total_count(conn)
+        rebuild_statistics(conn)
@@ -0,0 +1,131 @@
+# 详情页抓取：按车源的 dealerid/infoid 并发抓取 che168 详情页，
+# 一次遍历 .basic-item-ul li 提取全部参数，批量写入 car_detail_attrs
+import asyncio
+import html
+import time
+import lxml.html
+from lxml import etree
+from database import get_conn, pending_detail_targets, save_detail_attrs, record_detail_failures
+from crawler import AsyncCrawler, decode_html, with_retries, run_blocking
+
+DETAIL_URL = "https://www.che168.com/dealer/{dealerid}/{infoid}.html"
+DETAIL_LIMIT = 1000             # 每次最多抓取的详情页数
+DETAIL_BATCH_SIZE = 100         # 攒够多少条详情写一次
+DETAIL_RETRIES = 2              # 详情页最多尝试次数
+
+_BASIC_ITEMS = etree.XPath("//ul[contains(concat(' ', normalize-space(@class), ' '), ' basic-item-ul ')]/li")
+_ITEM_NAME = etree.XPath(".//span[contains(concat(' ', normalize-space(@class), ' '), ' item-name ')]")
+
+
+def _text(node):
+    return ''.join(text.strip() for text in node.itertext())
+
+
+def parse_detail_page(page_html):
+    """解析详情页 HTML（纯函数），返回 {标签: 值}，如 {'变速箱': '自动', '排量': '2.0T'}
+
+    每个 li 的 span.item-name 为标签，li 其余文本为值；同名标签只保留第一个
+    """
+    if not page_html or not page_html.strip():
+        return {}
+    tree = lxml.html.fromstring(page_html)
+    attrs = {}
+    for li in _BASIC_ITEMS(tree):
+        names = _ITEM_NAME(li)
+        if not names:
+            continue
+        label = _text(names[0])
+        value = _text(li).replace(label, '', 1)
+        label = html.unescape(label).rstrip('：:')
+        if label and label not in attrs:
+            attrs[label] = html.unescape(value)
+    return attrs
+
+
+class DetailCrawler(AsyncCrawler):
+    """并发抓取详情页；复用 AsyncCrawler 的全局/单域名并发限制、限速和响应缓存"""
+
+    def __init__(self, batch_size=DETAIL_BATCH_SIZE, retries=DETAIL_RETRIES, **kwargs):
+        super().__init__(with_images=False, **kwargs)
+        self.batch_size = batch_size
+        self.retries = retries
+        self._batch = []
+        self._misses = []               # 抓取失败或无参数的 (infoid, dealerid)，记录后推迟重试
+        self.stats.update({'details': 0, 'details_empty': 0, 'details_failed': 0, 'written': 0})
+
+    async def crawl_detail(self, infoid, dealerid):
+        async with self._page_semaphore:
+            url = DETAIL_URL.format(dealerid=dealerid, infoid=infoid)
+            try:
+                (content, headers, not_modified), retries = await with_retries(
+                    lambda: self.fetch(url), self.retries)
+            except Exception as e:
+                self.stats['details_failed'] += 1
+                print(f"详情页请求失败（infoid：{infoid}）: {e!r}")
+                self._misses.append((infoid, dealerid))
+                return
+            self.stats['retries'] += retries
+            if not_modified:
+                self.stats['not_modified'] += 1
+            elif self.cache is not None:
+                await run_blocking(self.cache.store, url, headers, content)
+            attrs = parse_detail_page(decode_html(content))
+            if not attrs:
+                # 车源已下架或页面结构变化
+                self.stats['details_empty'] += 1
+                self._misses.append((infoid, dealerid))
+                return
+            self.stats['details'] += 1
+            self._batch.append((infoid, dealerid, attrs))
+            if len(self._batch) >= self.batch_size:
+                await self._flush()
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if batch:
+            self.stats['written'] += await run_blocking(self._save, batch)
+        misses, self._misses = self._misses, []
+        if misses:
+            await run_blocking(self._record_misses, misses)
+
+    @staticmethod
+    def _save(batch):
+        with get_conn() as conn:
+            return save_detail_attrs(conn, batch)
+
+    @staticmethod
+    def _record_misses(misses):
+        with get_conn() as conn:
+            return record_detail_failures(conn, misses)
+
+    async def run(self, targets):
+        """抓取 [(infoid, dealerid), ...] 的详情页，结束（或取消）时写入剩余结果"""
+        start = time.perf_counter()
+        async with self._open_session() as session:
+            self._session = session
+            tasks = [asyncio.create_task(self.crawl_detail(infoid, dealerid)) for infoid, dealerid in targets]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await self._flush()
+        self.stats['elapsed'] = time.perf_counter() - start
+        elapsed = self.stats['elapsed'] or 1e-9
+        print(f"[DETAIL] 详情页 {self.stats['details']} 成功 / {self.stats['details_failed']} 失败 / "
+              f"{self.stats['details_empty']} 无参数，写入 {self.stats['written']} 条，"
+              f"重试 {self.stats['retries']} 次，{self.stats['details'] / elapsed:.2f} 页/秒")
+        self._report_rates()
+        return self.stats
+
+
+def crawl_details(limit=DETAIL_LIMIT, **kwargs):
+    """同步入口：抓取还没有详情参数（或列表信息有变化）的车源"""
+    with get_conn() as conn:
+        targets = pending_detail_targets(conn, limit)
+    if not targets:
+        print("没有需要抓取详情的车源")
+        return None
+    print(f"开始抓取 {len(targets)} 个详情页...")
+    return asyncio.run(DetailCrawler(**kwargs).run(targets))
@@ -0,0 +1,213 @@
+# 列表页多条件筛选：进程内位图索引（Python 大整数，第 i 位对应按 id 排序的第 i 辆车），
+# 品牌、上牌年份、里程区间、价格区间任意组合用位运算求交，分面计数用 popcount；数据版本变化后重建
+import threading
+import time
+import pymysql
+from database import get_conn, price_label
+
+FACET_LOAD_BATCH = 5000         # 构建索引时每批读取的行数
+FACET_BLOCK_BYTES = 512         # 分页定位时每块的字节数（4096 位）
+
+# 里程区间：左闭右开，单位"万公里"
+MILEAGE_SEGMENTS = [
+    (0, 1, "1万公里内"),
+    (1, 3, "1-3万公里"),
+    (3, 6, "3-6万公里"),
+    (6, 10, "6-10万公里"),
+    (10, None, "10万公里以上")
+]
+
+FACET_NAMES = ('brand', 'year', 'mileage', 'price')
+
+# 位图中 1 的个数：int.bit_count 需要 Python 3.10+，旧版本退回 bin().count
+_popcount = getattr(int, 'bit_count', None) or (lambda mask: bin(mask).count('1'))
+
+
+def mileage_label(mileage_km):
+    """里程（公里）对应的区间标签，未知返回 None"""
+    if mileage_km is None:
+        return None
+    for low, high, tag in MILEAGE_SEGMENTS:
+        if mileage_km >= low * 10000 and (high is None or mileage_km < high * 10000):
+            return tag
+    return None
+
+
+def _bitmap(positions, size):
+    """由位置列表生成位图（先写 bytearray 再一次转换，避免逐位 |= 产生大量大整数拷贝）"""
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+class _Snapshot:
+    """一次构建的只读索引：ids[i] 为第 i 位对应的车源 id，bitmaps[分面][取值] 为位图"""
+
+    def __init__(self, rows):
+        self.ids = []
+        positions = {name: {} for name in FACET_NAMES}
+        for position, row in enumerate(rows):
+            self.ids.append(row['id'])
+            values = {
+                'brand': row['brand'],
+                'year': row['reg_year'],
+                'mileage': mileage_label(row['mileage_km']),
+                'price': price_label(row['price_wan'])
+            }
+            for name, value in values.items():
+                if value is not None:
+                    positions[name].setdefault(value, []).append(position)
+        self.size = len(self.ids)
+        self.all = (1 << self.size) - 1
+        self.bitmaps = {name: {value: _bitmap(found, self.size) for value, found in by_value.items()}
+                        for name, by_value in positions.items()}
+
+    def mask(self, name, values):
+        """某个分面选中取值的并集；values 为 None 时返回 None（不限制）"""
+        if values is None:
+            return None
+        bitmaps = self.bitmaps[name]
+        mask = 0
+        for value in values:
+            mask |= bitmaps.get(value, 0)
+        return mask
+
+    def select(self, mask, start, count):
+        """按 id 升序取位图中第 start 个起的 count 个车源 id
+
+        按块 popcount 跳过前面的整块，只在目标块内逐位展开
+        """
+        data = mask.to_bytes((self.size + 7) // 8, 'little')
+        ids = []
+        skip = start
+        for offset in range(0, len(data), FACET_BLOCK_BYTES):
+            block = int.from_bytes(data[offset:offset + FACET_BLOCK_BYTES], 'little')
+            if not block:
+                continue
+            bits = _popcount(block)
+            if skip >= bits:
+                skip -= bits
+                continue
+            base = offset * 8
+            while block and len(ids) < count:
+                low = block & -block
+                if skip:
+                    skip -= 1
+                else:
+                    ids.append(self.ids[base + low.bit_length() - 1])
+                block ^= low
+            if len(ids) >= count:
+                break
+        return ids
+
+
+class FacetIndex:
+    """分面筛选引擎：筛选条件为 {'brand': [...], 'mileage': [...], 'price': [...], 'year_min': 年, 'year_max': 年}，
+    同一分面内取值为"或"，不同分面之间为"与"，未给出的分面不限制；分面计数不受该分面自身选择的影响"""
+
+    def __init__(self):
+        self._snapshot = None
+        self._stale = True
+        self._refresh_lock = threading.Lock()     # 同一时间只有一个线程重建
+        self._stats_lock = threading.Lock()
+        self._stats = {'queries': 0, 'query_time_total': 0.0, 'builds': 0, 'build_time': 0.0}
+
+    def invalidate(self):
+        """标记索引需要重建（数据版本变化时调用）"""
+        self._stale = True
+
+    def build(self):
+        """全量重建：只读取筛选用到的字段，构建完成后整体替换"""
+        self._stale = False
+        start = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                rows = self._load(conn)
+        except Exception as e:
+            print(f"构建筛选索引失败: {e}")
+            self._stale = True
+            return False
+        self._snapshot = _Snapshot(rows)
+        with self._stats_lock:
+            self._stats['builds'] += 1
+            self._stats['build_time'] = time.perf_counter() - start
+        return True
+
+    def ensure_current(self):
+        """索引过期时重建：首次构建时等待，之后由一个线程重建，其余请求继续用旧索引"""
+        if not self._stale:
+            return
+        if not self._refresh_lock.acquire(blocking=self._snapshot is None):
+            return
+        try:
+            if self._stale:
+                self.build()
+        finally:
+            self._refresh_lock.release()
+
+    def query(self, filters, page=1, per_page=24):
+        """返回 (当前页车源 id 列表, 命中总数, 分面计数)，索引不可用时返回 None
+
+        分面计数为 {分面: {取值: 数量}}：每个分面用其余分面的筛选结果与各取值位图求交计数，
+        所有分面在同一次调用中算出
+        """
+        self.ensure_current()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        start = time.perf_counter()
+        filters = dict(filters)
+        year_min, year_max = filters.get('year_min'), filters.get('year_max')
+        if year_min is not None or year_max is not None:
+            # 年份区间展开为区间内各年份位图的并集
+            filters['year'] = [year for year in snapshot.bitmaps['year']
+                               if (year_min is None or year >= year_min) and (year_max is None or year <= year_max)]
+        masks = {name: snapshot.mask(name, filters.get(name)) for name in FACET_NAMES}
+        matched = snapshot.all
+        for mask in masks.values():
+            if mask is not None:
+                matched &= mask
+
+        counts = {}
+        for name in FACET_NAMES:
+            others = snapshot.all
+            for other, mask in masks.items():
+                if other != name and mask is not None:
+                    others &= mask
+            counts[name] = {value: _popcount(bitmap & others)
+                            for value, bitmap in snapshot.bitmaps[name].items()}
+
+        total = _popcount(matched)
+        ids = snapshot.select(matched, (max(1, page) - 1) * per_page, per_page)
+        with self._stats_lock:
+            self._stats['queries'] += 1
+            self._stats['query_time_total'] += time.perf_counter() - start
+        return ids, total, counts
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        snapshot = self._snapshot
+        data['documents'] = snapshot.size if snapshot else 0
+        data['bitmaps'] = sum(len(values) for values in snapshot.bitmaps.values()) if snapshot else 0
+        data['query_time_avg'] = data['query_time_total'] / data['queries'] if data['queries'] else 0.0
+        return data
+
+    def _load(self, conn):
+        rows = []
+        last_id = 0
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            while True:
+                cursor.execute("""
+                    SELECT id, brand, reg_year, mileage_km, price_wan
+                    FROM carprice
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, FACET_LOAD_BATCH))
+                batch = cursor.fetchall()
+                rows.extend(batch)
+                if len(batch) < FACET_LOAD_BATCH:
+                    return rows
+                last_id = batch[-1]['id']
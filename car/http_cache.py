@@ -0,0 +1,96 @@
+# 爬虫 HTTP 响应缓存：按 URL 落盘保存响应体和 ETag/Last-Modified，
+# 再次抓取时发送条件请求，304 时直接使用缓存内容；--replay 离线模式只读缓存
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+HTTP_CACHE_DIR = Path("http_cache")
+
+
+class ResponseCache:
+    """按 URL 的 SHA-1 分目录存放 <key>.json（元数据）和 <key>.body（响应体）
+
+    图片只记录元数据（上传成功后才登记），列表页同时保存响应体供 304 和离线回放使用
+    """
+
+    def __init__(self, root=HTTP_CACHE_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._stats = {'not_modified': 0, 'fetched': 0, 'stored': 0, 'replayed': 0}
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        directory = self.root / key[:2]
+        return directory / f"{key}.json", directory / f"{key}.body"
+
+    def meta(self, url):
+        """返回缓存的元数据字典，没有缓存时返回 None"""
+        meta_path, _ = self._paths(url)
+        try:
+            return json.loads(meta_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def body(self, url):
+        """返回缓存的响应体，没有缓存时返回 None"""
+        _, body_path = self._paths(url)
+        try:
+            return body_path.read_bytes()
+        except OSError:
+            return None
+
+    def conditional_headers(self, url, need_body=True):
+        """根据缓存生成 If-None-Match / If-Modified-Since 请求头
+
+        need_body=True 时只有响应体仍在才发条件请求，否则 304 无内容可用
+        """
+        meta = self.meta(url)
+        if not meta or (need_body and not meta.get('has_body')):
+            return {}
+        if need_body and not self._paths(url)[1].exists():
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, url, headers, body=None):
+        """登记一次 200 响应；没有 ETag/Last-Modified 且不保存响应体时不落盘"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if body is None and not (etag or last_modified):
+            return False
+        meta_path, body_path = self._paths(url)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        if body is not None:
+            _atomic_write(body_path, body)
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                'has_body': body is not None, 'size': len(body) if body is not None else None,
+                'fetched_at': time.time()}
+        _atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._count('stored')
+        return True
+
+    def record(self, name):
+        """记录一次命中类型：not_modified / fetched / replayed"""
+        self._count(name)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+def _atomic_write(path, data):
+    """先写临时文件再替换，抓取中断时不会留下半个缓存文件"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
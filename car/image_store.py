@@ -0,0 +1,123 @@
+# 图片去重：按内容哈希记录已上传到七牛的图片，
+# 同一 key 内容未变时跳过上传，相同内容换了 key 时用七牛服务端复制代替重新上传
+import hashlib
+import threading
+from database import get_conn
+
+IMAGE_SKIPPED = 'skipped'       # key 已经是这份内容
+IMAGE_COPIED = 'copied'         # 内容已在其他 key 下，服务端复制
+IMAGE_UPLOADED = 'uploaded'     # 新内容，实际上传
+
+
+def init_image_tables(conn):
+    """创建图片清单表：image_blobs 为内容哈希 -> 首次上传的 key，image_keys 为 key -> 当前内容哈希"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                content_hash CHAR(40) PRIMARY KEY,
+                qiniu_key VARCHAR(255) NOT NULL,
+                size INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_keys (
+                qiniu_key VARCHAR(255) PRIMARY KEY,
+                content_hash CHAR(40) NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """)
+            conn.commit()
+    except Exception as e:
+        print(f"初始化图片清单表失败: {e}")
+        conn.rollback()
+
+
+class ImageManifest:
+    """图片清单：启动时整体加载到内存，上传前在内存中判断，写入时同步落库（线程安全）"""
+
+    def __init__(self):
+        self._by_key = {}       # qiniu_key -> content_hash
+        self._by_hash = {}      # content_hash -> qiniu_key（可作为复制源）
+        self._lock = threading.Lock()
+        self._stats = {IMAGE_SKIPPED: 0, IMAGE_COPIED: 0, IMAGE_UPLOADED: 0, 'bytes_saved': 0}
+
+    def load(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT qiniu_key, content_hash FROM image_keys")
+            by_key = dict(cursor.fetchall())
+            cursor.execute("SELECT content_hash, qiniu_key FROM image_blobs")
+            by_hash = dict(cursor.fetchall())
+        with self._lock:
+            self._by_key = by_key
+            self._by_hash = by_hash
+        return self
+
+    def store(self, data, key, upload, copy):
+        """保证七牛上 key 对应 data，返回 IMAGE_SKIPPED/IMAGE_COPIED/IMAGE_UPLOADED，失败返回 None
+
+        upload(data, key) 和 copy(源 key, 目标 key) 为实际的七牛操作，成功返回 True
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            current = self._by_key.get(key)
+            source = self._by_hash.get(digest)
+        if current == digest:
+            action = IMAGE_SKIPPED
+        elif source is not None and source != key and copy(source, key):
+            action = IMAGE_COPIED
+        elif upload(data, key):
+            action = IMAGE_UPLOADED
+        else:
+            return None
+        if action != IMAGE_SKIPPED:
+            self._record(key, digest, len(data), current)
+        with self._lock:
+            self._stats[action] += 1
+            if action != IMAGE_UPLOADED:
+                self._stats['bytes_saved'] += len(data)
+        return action
+
+    def has(self, key):
+        """key 是否已登记（已上传过）"""
+        with self._lock:
+            return key in self._by_key
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _record(self, key, digest, size, previous):
+        """登记 key 的新内容；key 原来的内容若以它为复制源，改用仍保存该内容的其他 key"""
+        replacement = None
+        with self._lock:
+            if previous is not None and self._by_hash.get(previous) == key:
+                replacement = next((k for k, h in self._by_key.items() if h == previous and k != key), None)
+        try:
+            with get_conn() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO image_keys (qiniu_key, content_hash) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE content_hash = VALUES(content_hash)
+                """, (key, digest))
+                cursor.execute("INSERT IGNORE INTO image_blobs (content_hash, qiniu_key, size) VALUES (%s, %s, %s)",
+                               (digest, key, size))
+                if previous is not None:
+                    if replacement is not None:
+                        cursor.execute("UPDATE image_blobs SET qiniu_key = %s WHERE content_hash = %s AND qiniu_key = %s",
+                                       (replacement, previous, key))
+                    else:
+                        cursor.execute("DELETE FROM image_blobs WHERE content_hash = %s AND qiniu_key = %s",
+                                       (previous, key))
+                conn.commit()
+        except Exception as e:
+            # 七牛上已经是新内容，清单落库失败只影响下次能否跳过
+            print(f"登记图片清单失败（{key}）: {e}")
+        with self._lock:
+            self._by_key[key] = digest
+            self._by_hash.setdefault(digest, key)
+            if previous is not None and self._by_hash.get(previous) == key:
+                if replacement is not None:
+                    self._by_hash[previous] = replacement
+                else:
+                    del self._by_hash[previous]
@@ -0,0 +1,142 @@
+# 爬虫入库：单写线程批量写入，取代每个页面线程各自建连接、各自提交
+import threading
+import queue
+import time
+from database import get_conn, save_data
+
+INGEST_BATCH_SIZE = 500         # 攒够多少条写一次
+INGEST_FLUSH_INTERVAL = 2.0     # 最早一条记录等待超过该秒数即写入
+INGEST_QUEUE_SIZE = 5000        # 队列上限，写入跟不上时阻塞爬虫线程（背压）
+
+_STOP = object()
+
+
+class _Written:
+    """队列中的回调标记：排在它之前的记录全部写入后触发"""
+
+    def __init__(self, callback, failures):
+        self.callback = callback
+        self.failures = failures    # 提交时的失败批次数，用于判断这些记录是否写入成功
+
+
+class IngestWriter:
+    """单写线程：爬虫线程 put() 解析好的记录，写线程按数量或时间攒批，
+    通过一条长连接批量插入；close() 时写完剩余数据并输出吞吐统计"""
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 max_queue=INGEST_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._started_at = None
+        self._stats = {'received': 0, 'written': 0, 'unchanged': 0, 'batches': 0, 'failed_batches': 0,
+                       'write_time': 0.0, 'put_wait_time': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def put(self, records, on_written=None):
+        """提交一批记录 [(carname, carmoney, caryear, infoid, dealerid), ...]；队列满时阻塞
+
+        on_written(ok) 在这些记录写入数据库（或写入失败）后由写线程调用
+        """
+        start = time.perf_counter()
+        failures = self._stats['failed_batches']
+        for record in records:
+            self._queue.put(record)
+        if on_written is not None:
+            self._queue.put(_Written(on_written, failures))
+        with self._stats_lock:
+            self._stats['received'] += len(records)
+            self._stats['put_wait_time'] += time.perf_counter() - start
+
+    def close(self):
+        """停止接收，写完队列中剩余记录后返回统计"""
+        self._queue.put(_STOP)
+        self._thread.join()
+        stats = self.stats()
+        print(f"[INGEST] 写入 {stats['written']}/{stats['received']} 条（未变化或重复 {stats['unchanged']} 条），"
+              f"{stats['batches']} 批，{stats['rows_per_sec']:.1f} 条/秒")
+        return stats
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        data['elapsed'] = elapsed
+        data['rows_per_sec'] = data['written'] / elapsed if elapsed else 0.0
+        return data
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        conn = None
+        batch = []
+        callbacks = []      # 等待当前批次写入后触发的回调
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, _Written):
+                    callbacks.append(item)
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                conn = self._flush(conn, batch)
+                batch = []
+                deadline = None
+            if callbacks and not batch:
+                self._notify(callbacks)
+                callbacks = []
+        if conn is not None:
+            conn.close()
+
+    def _notify(self, callbacks):
+        failures = self._stats['failed_batches']
+        for item in callbacks:
+            try:
+                item.callback(item.failures == failures)
+            except Exception as e:
+                print(f"[INGEST] 写入回调出错: {e}")
+
+    def _flush(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = get_conn()
+            columns = [list(column) for column in zip(*batch)]
+            # 返回实际插入和更新的条数（内容未变化的车源不计），失败时为 None
+            written = save_data(conn, *columns)
+        except Exception as e:
+            # 连接异常：丢弃长连接，下一批重新借出
+            print(f"[INGEST] 批量写入失败（{len(batch)} 条）: {e}")
+            written = None
+            if conn is not None:
+                conn.close()
+                conn = None
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            if written is None:
+                self._stats['failed_batches'] += 1
+            else:
+                self._stats['written'] += written
+                self._stats['unchanged'] += len(batch) - written
+            self._stats['write_time'] += time.perf_counter() - start
+        return conn
@@ -0,0 +1,131 @@
+# 车辆字段解析：价格、年份/里程（如 "2023年/3.2万公里"）、品牌型号
+import re
+from functools import lru_cache
+
+# 预编译正则，全项目只保留这一份解析规则
+PRICE_RE = re.compile(r'(\d+(?:\.\d+)?)')
+YEAR_RE = re.compile(r'(\d{4})年')
+MILEAGE_RE = re.compile(r'([\d,]+(?:\.\d+)?)(万?)公里')
+
+# 源站在价格、年份/里程文字中插入的私有区字符（U+E000），可能出现在数字中间，匹配前先去掉
+OBFUSCATION_CHAR = '\ue000'
+
+CARYEAR_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CARYEAR_CACHE_SIZE)
+def parse_caryear(caryear):
+    """解析年份+里程字符串，返回 (年份 int, 里程公里数 int)，解析不到为 None"""
+    if not caryear:
+        return None, None
+    caryear = caryear.replace(OBFUSCATION_CHAR, '')
+    reg_year = None
+    mileage_km = None
+    year_match = YEAR_RE.search(caryear)
+    if year_match:
+        reg_year = int(year_match.group(1))
+    mileage_match = MILEAGE_RE.search(caryear)
+    if mileage_match:
+        value = float(mileage_match.group(1).replace(',', ''))
+        mileage_km = int(round(value * 10000 if mileage_match.group(2) else value))
+    return reg_year, mileage_km
+
+
+def parse_price(carmoney):
+    """解析价格字符串（如 ￥25.80万），返回万元 float，解析不到为 None"""
+    price_match = PRICE_RE.search((carmoney or '').replace(OBFUSCATION_CHAR, '').replace(',', ''))
+    return round(float(price_match.group(1)), 2) if price_match else None
+
+
+def split_carname(carname):
+    """拆分车名为 (品牌, 型号)，缺失为 None"""
+    parts = (carname or '').split()
+    brand = parts[0] if parts else None
+    model = " ".join(parts[1:]) if len(parts) > 1 else None
+    return brand, model
+
+
+def format_year(reg_year):
+    """年份显示字符串"""
+    return str(reg_year) if reg_year else "未知"
+
+
+def format_mileage(mileage_km):
+    """里程显示字符串（如 3.2万公里、8000公里）"""
+    if mileage_km is None:
+        return "里程待询"
+    if mileage_km >= 10000:
+        return f"{round(mileage_km / 10000, 2):g}万公里"
+    return f"{mileage_km}公里"
+
+
+def parse_many(rows):
+    """批量解析年份和里程
+
+    rows 中每项可以是原始 caryear 字符串，或包含 caryear 的字典；字典里已有
+    reg_year/mileage_km（入库时解析好的字段）时直接使用，不再做正则匹配。
+    返回与 rows 等长的字典列表：year, mileage_km, year_display, mileage_display
+    """
+    results = []
+    for row in rows:
+        if isinstance(row, dict):
+            reg_year = row.get('reg_year')
+            mileage_km = row.get('mileage_km')
+            if reg_year is None and mileage_km is None:
+                reg_year, mileage_km = parse_caryear(row.get('caryear'))
+        else:
+            reg_year, mileage_km = parse_caryear(row)
+        results.append({
+            'year': reg_year,
+            'mileage_km': mileage_km,
+            'year_display': format_year(reg_year),
+            'mileage_display': format_mileage(mileage_km)
+        })
+    return results
+
+
+def _legacy_parse(caryear):
+    """旧版逐行解析逻辑（每行最多 4 次未编译的 re.search），仅用于基准对比"""
+    year = "未知"
+    mileage = "里程待询"
+    if caryear:
+        year_match = re.search(r'(\d{4})年', caryear)
+        if year_match:
+            year = year_match.group(1)
+        mileage_match = re.search(r'([\d.]+万?)公[里里]', caryear)
+        if mileage_match:
+            mileage = mileage_match.group(1) + "公里"
+        elif re.search(r'(\d+\.?\d*)万?公[里里]', caryear):
+            mileage_match = re.search(r'(\d+\.?\d*)万?公[里里]', caryear)
+            if mileage_match:
+                mileage = mileage_match.group(1) + "万公里"
+        else:
+            mileage_match = re.search(r'(\d+\.?\d*)公[里里]', caryear)
+            if mileage_match:
+                mileage = mileage_match.group(1) + "公里"
+    return year, mileage
+
+
+if __name__ == '__main__':
+    # 微基准：python car/parsing.py
+    import random
+    import time
+
+    random.seed(0)
+    samples = [f"{random.randint(2008, 2024)}年/{random.randint(1, 150) / 10}万公里" for _ in range(2000)]
+    samples += [f"{random.randint(2008, 2024)}年/{random.randint(100, 9999)}公里" for _ in range(500)]
+    rows = [random.choice(samples) for _ in range(200000)]
+
+    start = time.perf_counter()
+    for raw in rows:
+        _legacy_parse(raw)
+    legacy_rate = len(rows) / (time.perf_counter() - start)
+
+    parse_caryear.cache_clear()
+    start = time.perf_counter()
+    parse_many(rows)
+    batch_rate = len(rows) / (time.perf_counter() - start)
+
+    print(f"旧版逐行解析: {legacy_rate:,.0f} 行/秒")
+    print(f"parse_many:   {batch_rate:,.0f} 行/秒（{batch_rate / legacy_rate:.1f}x）")
+    print(f"缓存命中: {parse_caryear.cache_info()}")
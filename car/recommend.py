@@ -0,0 +1,120 @@
+# 首页推荐：进程内候选池，取代每次请求 ORDER BY RAND() 全表扫描
+import threading
+import random
+import time
+import pymysql
+from database import get_conn, car_rows_to_dicts
+
+RECOMMEND_POOL_SIZE = 200     # 候选池大小
+RECOMMEND_WINDOWS = 8         # 每次刷新随机探测的主键区间个数
+RECOMMEND_POOL_TTL = 300      # 候选池刷新间隔（秒），需小于图片签名有效期
+
+
+def _score(row):
+    """推荐分：年份越新、里程越少分越高（用于加权抽样）"""
+    score = 1.0
+    if row.get('reg_year'):
+        score += max(0, row['reg_year'] - 2010) / 5
+    if row.get('mileage_km') is not None:
+        score += max(0.0, 10 - row['mileage_km'] / 10000) / 5
+    return score
+
+
+class RecommendationPool:
+    """推荐候选池：定期用主键随机区间探测加载候选，请求时直接在内存中抽样"""
+
+    def __init__(self, image_urls, pool_size=RECOMMEND_POOL_SIZE, windows=RECOMMEND_WINDOWS,
+                 ttl=RECOMMEND_POOL_TTL):
+        self.image_urls = image_urls    # carname -> 图片地址字典（合并到车辆字典中）
+        self.pool_size = pool_size
+        self.windows = windows
+        self.ttl = ttl
+        self._candidates = []           # [(车辆字典, 推荐分)]，刷新时整体替换
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def sample(self, k=8, weighted=False):
+        """抽取 k 辆推荐车辆；weighted=True 时按推荐分加权（不放回）"""
+        candidates = self._current()
+        if not candidates:
+            return []
+        k = min(k, len(candidates))
+        if weighted:
+            # Efraimidis-Spirakis 加权不放回抽样
+            picks = sorted(candidates, key=lambda c: random.random() ** (1 / c[1]), reverse=True)[:k]
+        else:
+            picks = random.sample(candidates, k)
+        return [dict(car) for car, _ in picks]
+
+    def invalidate(self):
+        """标记候选池过期，下次请求时在后台刷新（入库后调用）"""
+        self._expires = 0.0
+
+    def refresh(self):
+        """同步刷新候选池"""
+        try:
+            with get_conn() as conn:
+                rows = self._load(conn)
+        except Exception as e:
+            print(f"刷新推荐候选池失败: {e}")
+            return False
+        candidates = []
+        for car, row in zip(car_rows_to_dicts(rows), rows):
+            car.update(self.image_urls(car['name']))
+            candidates.append((car, _score(row)))
+        with self._lock:
+            self._candidates = candidates
+            self._expires = time.monotonic() + self.ttl
+        return True
+
+    def _current(self):
+        if not self._candidates:
+            # 首次使用：同步加载
+            self.refresh()
+        elif time.monotonic() >= self._expires:
+            # 过期：先返回旧候选，后台刷新
+            with self._lock:
+                if self._refreshing:
+                    return self._candidates
+                self._refreshing = True
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return self._candidates
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def _load(self, conn):
+        """在 [MIN(id), MAX(id)] 内随机取若干起点，每个起点按主键顺序读一小段"""
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM carprice")
+            bounds = cursor.fetchone()
+            if not bounds or bounds['min_id'] is None:
+                return []
+            per_window = max(1, self.pool_size // self.windows)
+            rows = {}
+            for _ in range(self.windows):
+                start = random.randint(bounds['min_id'], bounds['max_id'])
+                cursor.execute("""
+                    SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km
+                    FROM carprice
+                    WHERE id >= %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (start, per_window))
+                window = list(cursor.fetchall())
+                if len(window) < per_window:
+                    # 起点靠近末尾时从头部补足
+                    cursor.execute("""
+                        SELECT id, carname, carmoney, caryear, brand, model, reg_year, mileage_km
+                        FROM carprice
+                        ORDER BY id
+                        LIMIT %s
+                    """, (per_window - len(window),))
+                    window += cursor.fetchall()
+                for row in window:
+                    rows[row['id']] = row
+            return list(rows.values())
@@ -0,0 +1,237 @@
+# 车名全文搜索：进程内倒排索引（中文按字二元组切分 + 品牌/英文数字整词），
+# 取代 LIKE '%关键词%' 全表扫描；启动时全量构建，数据版本变化后按 updated_at 增量更新
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+import pymysql
+from database import get_conn, car_rows_to_dicts
+
+SEARCH_PAGE_SIZE = 24           # 每页结果数
+SEARCH_MAX_QUERY = 64           # 查询串最长字符数，超出部分忽略
+SEARCH_LOAD_BATCH = 5000        # 构建索引时每批读取的行数
+BRAND_BOOST = 2.0               # 查询词命中品牌整词时的加权
+
+# 连续的中文字符，或连续的英文字母/数字（如 X5、2023款 中的 2023）
+_TOKEN_RE = re.compile(r'[一-鿿]+|[a-z0-9]+(?:\.[0-9]+)?')
+_CJK_RE = re.compile(r'[一-鿿]')
+
+_ROW_FIELDS = 'id, carname, carmoney, caryear, brand, model, reg_year, mileage_km, price_wan, updated_at'
+
+
+def _normalize(text):
+    """全角转半角、统一小写"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """切分为索引词：中文连续段产出字二元组（单字段产出单字），英文数字段产出整词"""
+    tokens = []
+    for segment in _TOKEN_RE.findall(_normalize(text)):
+        if _CJK_RE.match(segment) and len(segment) > 1:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+def _doc_tokens(row):
+    """车源的索引词：车名切分结果 + 品牌整词（带 brand: 前缀，与二元组区分）"""
+    tokens = set(tokenize(row['carname']))
+    if row.get('brand'):
+        tokens.add('brand:' + _normalize(row['brand']))
+    return tokens
+
+
+class SearchIndex:
+    """倒排索引：词 -> 车源 id 集合；查询时按集合求交排序（部分匹配按 IDF 打分），只取当前页"""
+
+    def __init__(self, page_size=SEARCH_PAGE_SIZE):
+        self.page_size = page_size
+        self._postings = {}         # 词 -> {id, ...}
+        self._chars = {}            # 单个汉字 -> 含该字的二元组（单字查询时展开）
+        self._docs = {}             # id -> (索引词, 结果行)
+        self._watermark = None      # 已索引的最大 updated_at，增量更新从这里开始
+        self._stale = True
+        self._lock = threading.Lock()             # 保护索引数据
+        self._refresh_lock = threading.Lock()     # 同一时间只有一个线程构建/更新
+        self._stats = {'queries': 0, 'query_time_total': 0.0, 'builds': 0, 'updates': 0}
+
+    def invalidate(self):
+        """标记索引需要增量更新（数据版本变化时调用）"""
+        self._stale = True
+
+    def build(self):
+        """全量构建索引"""
+        # 先清除标记：读取期间再有数据版本变化时，下次查询会再更新一次
+        self._stale = False
+        try:
+            with get_conn() as conn:
+                rows = self._load(conn)
+        except Exception as e:
+            print(f"构建搜索索引失败: {e}")
+            self._stale = True
+            return False
+        # 在新实例上构建，查询只在最后替换引用时等待
+        fresh = SearchIndex(self.page_size)
+        fresh._apply(rows)
+        with self._lock:
+            self._postings, self._chars, self._docs = fresh._postings, fresh._chars, fresh._docs
+            self._watermark = fresh._watermark
+            self._stats['builds'] += 1
+        return True
+
+    def update(self):
+        """增量更新：只读取 updated_at 不早于水位线的车源（同一秒内的写入会重读，按 id 覆盖）"""
+        if self._watermark is None:
+            return self.build()
+        self._stale = False
+        try:
+            with get_conn() as conn:
+                rows = self._load(conn, since=self._watermark)
+        except Exception as e:
+            print(f"更新搜索索引失败: {e}")
+            self._stale = True
+            return False
+        with self._lock:
+            self._apply(rows)
+            self._stats['updates'] += 1
+        return True
+
+    def search(self, query, page=1):
+        """返回 (当前页车辆字典列表, 命中总数)，按相关度降序、同分时新车源在前"""
+        self.ensure_current()
+        start = time.perf_counter()
+        query = query[:SEARCH_MAX_QUERY]
+        page = max(1, page)
+        with self._lock:
+            ranked, total = self._rank(set(tokenize(query)), set(_TOKEN_RE.findall(_normalize(query))),
+                                       page * self.page_size)
+            rows = [self._docs[car_id][1] for car_id in ranked[(page - 1) * self.page_size:]]
+        cars = car_rows_to_dicts(rows)
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['query_time_total'] += time.perf_counter() - start
+        return cars, total
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['documents'] = len(self._docs)
+            data['terms'] = len(self._postings)
+        data['query_time_avg'] = data['query_time_total'] / data['queries'] if data['queries'] else 0.0
+        return data
+
+    def ensure_current(self):
+        """索引过期时构建或增量更新：首次构建时等待；之后由一个线程更新，其余请求继续用旧索引"""
+        if not self._stale:
+            return
+        built = self._stats['builds'] > 0
+        if not self._refresh_lock.acquire(blocking=not built):
+            return
+        try:
+            if self._stale:
+                self.update()
+        finally:
+            self._refresh_lock.release()
+
+    def _rank(self, terms, segments, limit):
+        """返回 (前 limit 个车源 id, 命中总数)
+
+        含全部查询词的车源优先：它们的 IDF 之和相同，只按是否命中品牌整词分两档，
+        档内新车源（id 大）在前，全部用集合运算完成；没有车源含全部查询词时，
+        退化为按命中词 IDF 累加打分的部分匹配
+        """
+        postings = [self._term_ids(term) for term in terms]
+        if not postings:
+            return [], 0
+        brand_ids = set().union(*(self._postings.get('brand:' + segment, ()) for segment in segments))
+        if all(postings):
+            matched = set.intersection(*sorted(postings, key=len))
+            if matched:
+                ranked = []
+                for tier in (matched & brand_ids, matched - brand_ids):
+                    if len(ranked) >= limit:
+                        break
+                    # 整数集合近似按升序迭代，C 实现的 sorted 比 heapq.nlargest 逐个比较快得多
+                    ranked.extend(sorted(tier, reverse=True)[:limit - len(ranked)])
+                return ranked, len(matched)
+
+        total_docs = len(self._docs) or 1
+        scores = {}
+        for ids in postings:
+            if not ids:
+                continue
+            idf = math.log(1 + total_docs / len(ids))
+            for car_id in ids:
+                scores[car_id] = scores.get(car_id, 0.0) + idf
+        if brand_ids:
+            boost = math.log(1 + total_docs / len(brand_ids)) * BRAND_BOOST
+            for car_id in brand_ids & scores.keys():
+                scores[car_id] += boost
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [car_id for car_id, _ in top], len(scores)
+
+    def _term_ids(self, term):
+        """查询词对应的车源 id 集合；单个汉字展开为包含它的二元组"""
+        ids = self._postings.get(term, set())
+        if len(term) == 1 and _CJK_RE.match(term):
+            ids = ids.union(*(self._postings[bigram] for bigram in self._chars.get(term, ())))
+        return ids
+
+    def _apply(self, rows):
+        """写入（或覆盖）一批车源（调用方持有锁）"""
+        for row in rows:
+            car_id = row['id']
+            tokens = _doc_tokens(row)
+            previous = self._docs.get(car_id)
+            if previous is not None:
+                for token in previous[0] - tokens:
+                    ids = self._postings.get(token)
+                    if ids is not None:
+                        ids.discard(car_id)
+                        if not ids:
+                            del self._postings[token]
+                            self._forget_chars(token)
+            for token in tokens:
+                ids = self._postings.get(token)
+                if ids is None:
+                    ids = self._postings[token] = set()
+                    if len(token) == 2 and _CJK_RE.match(token):
+                        for char in token:
+                            self._chars.setdefault(char, set()).add(token)
+                ids.add(car_id)
+            updated_at = row.pop('updated_at', None)
+            self._docs[car_id] = (tokens, row)
+            if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                self._watermark = updated_at
+
+    def _forget_chars(self, token):
+        if len(token) == 2 and _CJK_RE.match(token):
+            for char in token:
+                bigrams = self._chars.get(char)
+                if bigrams is not None:
+                    bigrams.discard(token)
+
+    def _load(self, conn, since=None):
+        """按 id 分批读取车源（since 不为空时只读 updated_at >= since 的行）"""
+        rows = []
+        last_id = 0
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            while True:
+                if since is None:
+                    cursor.execute(f"SELECT {_ROW_FIELDS} FROM carprice WHERE id > %s ORDER BY id LIMIT %s",
+                                   (last_id, SEARCH_LOAD_BATCH))
+                else:
+                    cursor.execute(f"""
+                        SELECT {_ROW_FIELDS} FROM carprice
+                        WHERE updated_at >= %s AND id > %s
+                        ORDER BY id LIMIT %s
+                    """, (since, last_id, SEARCH_LOAD_BATCH))
+                batch = cursor.fetchall()
+                rows.extend(batch)
+                if len(batch) < SEARCH_LOAD_BATCH:
+                    return rows
+                last_id = batch[-1]['id']
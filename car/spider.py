@@ -1,7 +1,11 @@
 from bs4 import BeautifulSoup
+import argparse
+import lxml.html
+from lxml import etree
 from pathlib import Path
 import threading
 import requests
+from urllib3.util.retry import Retry
 import time
 import sys
 import os
@@ -15,12 +19,18 @@ project_root = os.path.join(os.path.dirname(__file__), '..')
 sys.path.insert(0, project_root)
 
 # 从项目根目录导入数据库模块
-from database import get_conn, save_data, init_table
+from database import get_conn, save_data, init_table, DB_CONFIG
 from utils import safe_name, q, BUCKET_NAME
+from ingest import IngestWriter
+from crawl_state import init_crawl_tables, start_run, resume_run, finish_run, last_successful_run
+from http_cache import ResponseCache
+from image_store import ImageManifest, init_image_tables
 
-# 配置请求会话，增加重试机制和超时设置
+# 配置请求会话，增加重试机制和超时设置：429/5xx 按指数退避重试，遵守 Retry-After
 session = requests.Session()
-adapter = requests.adapters.HTTPAdapter(max_retries=3)
+retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+              respect_retry_after_header=True)
+adapter = requests.adapters.HTTPAdapter(max_retries=retry)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
@@ -40,52 +50,123 @@ def upload_to_bucket(local_path, key):
         return False
 
 
-def car(page=1):
-    url = f"https://car.autohome.com.cn/2sc/china/a0_0msdgscncgpi1ltocsp{page}ex/"
-    headers = {
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                      'AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0'
-    }
-    save_dir = Path("car_img")
-    save_dir.mkdir(exist_ok=True)
+def upload_bytes(data, key):
+    """直接上传内存中的图片数据到七牛云"""
     try:
-        res = session.get(url, headers=headers, timeout=(5, 10))
-        res.encoding = res.apparent_encoding
+        token = q.upload_token(BUCKET_NAME, key)
+        ret, info = qiniu.put_data(token, key, data)
+        return info.status_code == 200
     except Exception as e:
-        print(f"页面请求失败（页码：{page}）: {e}")
-        return
+        print(f"[UPL_ERR] {key} -> 七牛云失败: {e}")
+        return False
 
-    soup = BeautifulSoup(res.text, 'lxml')
 
-    # 提取所有车名
-    carname = [span.get_text(strip=True) for span in soup.select('.title')]
-    # 提取所有汽车价格
-    carmoney = [span.get_text(strip=True) for span in soup.select('.detail-r')]
-    # 提取所有汽车年份和公里数
-    caryear = [span.get_text(strip=True) for span in soup.select('.detail-l')]
+def copy_object(src_key, dst_key):
+    """七牛服务端复制（覆盖目标 key），用于内容相同的图片，不占用上传带宽"""
+    try:
+        ret, info = qiniu.BucketManager(q).copy(BUCKET_NAME, src_key, BUCKET_NAME, dst_key, force='true')
+        return info.status_code == 200
+    except Exception as e:
+        print(f"[UPL_ERR] {src_key} -> {dst_key} 复制失败: {e}")
+        return False
+
 
-    # 确保三个列表长度一致，避免数据错位
-    min_length = min(len(carname), len(carmoney), len(caryear))
-    carname = carname[:min_length]
-    carmoney = carmoney[:min_length]
-    caryear = caryear[:min_length]
+LIST_URL = "https://car.autohome.com.cn/2sc/china/a0_0msdgscncgpi1ltocsp{page}ex/"
+HEADERS = {
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                  'AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0'
+}
+SAVE_DIR = Path("car_img")
 
-    # 保存数据到MySQL
+
+def _to_int(value):
     try:
-        conn = get_conn()
-        # 每个线程不再重复初始化表（已在主线程初始化）
-        save_data(conn, carname, carmoney, caryear)
-        conn.close()
-    except Exception as e:
-        print(f"数据库操作失败（页码：{page}）: {e}")
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-    # 处理图片下载
+
+def _class_xpath(name):
+    return etree.XPath(f".//*[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]")
+
+
+# 每个车源卡片内的相对路径，预编译后逐卡片复用
+_CARD_TITLE = _class_xpath('title')
+_CARD_PRICE = _class_xpath('detail-r')
+_CARD_YEAR = _class_xpath('detail-l')
+_CARD_IMAGE = etree.XPath(".//img[@name='LazyloadImg'][@src2]")
+
+
+def _card_text(card, path):
+    """卡片内第一个匹配节点的文本，与 BeautifulSoup get_text(strip=True) 结果一致"""
+    nodes = path(card)
+    if not nodes:
+        return None
+    return ''.join(text.strip() for text in nodes[0].itertext())
+
+
+def parse_list_page(page_html):
+    """解析列表页 HTML（纯函数），返回 (records, images)
+
+    records: [(carname, carmoney, caryear, infoid, dealerid), ...]
+    images:  [(图片链接, 图片标题), ...]
+
+    用 lxml 逐个车源卡片（li[infoid]）遍历一次，字段缺失只会丢弃该卡片，不会让其他车源错位
+    """
+    if not page_html or not page_html.strip():
+        return [], []
+    tree = lxml.html.fromstring(page_html)
+    records = []
+    images = []
+    for card in tree.iterfind('.//li[@infoid]'):
+        title = _card_text(card, _CARD_TITLE)
+        price = _card_text(card, _CARD_PRICE)
+        year = _card_text(card, _CARD_YEAR)
+        if title and price and year:
+            records.append((title, price, year, _to_int(card.get('infoid')), _to_int(card.get('dealerid'))))
+        for img in _CARD_IMAGE(card):
+            images.append((img.get('src2'), img.get('title', '')))
+    return records, images
+
+
+def _parse_list_page_soup(page_html):
+    """旧的 BeautifulSoup 解析方式，仅用于基准对比"""
+    soup = BeautifulSoup(page_html, 'lxml')
+    records = []
+    for li in soup.select('li[infoid]'):
+        title = li.select_one('.title')
+        price = li.select_one('.detail-r')
+        year = li.select_one('.detail-l')
+        if not (title and price and year):
+            continue
+        records.append((title.get_text(strip=True), price.get_text(strip=True), year.get_text(strip=True),
+                        _to_int(li.get('infoid')), _to_int(li.get('dealerid'))))
     img_tags = soup.find_all('img', attrs={'name': 'LazyloadImg'})
     images = [(img['src2'], img['title']) for img in img_tags if 'src2' in img.attrs]
+    return records, images
+
+
+def benchmark_parsers(documents, rounds=5):
+    """在保存的列表页上对比 lxml 与 BeautifulSoup 解析吞吐（页/秒），并检查两者记录是否一致"""
+    results = {}
+    for label, parse in (('lxml', parse_list_page), ('bs4', _parse_list_page_soup)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            parsed = [parse(document) for document in documents]
+        elapsed = time.perf_counter() - start
+        results[label] = parsed
+        print(f"[BENCH] {label:5s} {len(documents) * rounds / (elapsed or 1e-9):8.1f} 页/秒")
+    same = [r for r, _ in results['lxml']] == [r for r, _ in results['bs4']]
+    print(f"[BENCH] 记录一致: {'是' if same else '否'}")
+    return same
 
+
+def image_jobs(images):
+    """把 (链接, 标题) 转换为 (完整链接, 文件名)，同名图片按出现顺序编号"""
+    jobs = []
     title_count = {}
-    for idx, (link, title) in enumerate(images, 1):
+    for link, title in images:
         # 补全协议
         if link.startswith("//"):
             link = "https:" + link
@@ -93,28 +174,93 @@ def car(page=1):
         ext = os.path.splitext(link)[1] or ".jpg"
         sname = safe_name(title)
         # 统计同名图片序号
-        if sname not in title_count:
-            title_count[sname] = 1
-        else:
-            title_count[sname] += 1
-        img_index = title_count[sname]
-        file_path = save_dir / f"{sname}_{img_index}{ext}"
+        title_count[sname] = title_count.get(sname, 0) + 1
+        jobs.append((link, f"{sname}_{title_count[sname]}{ext}"))
+    return jobs
+
+
+def store_records(records, writer=None, page=None, on_written=None):
+    """保存数据到MySQL：有写线程时交给写线程批量写入，否则直接写入
 
+    on_written(ok) 在记录实际写入数据库后调用（用于记录爬取断点）
+    """
+    if writer is not None:
+        writer.put(records, on_written)
+        return
+    written = None
+    try:
+        # 从连接池借出连接，每个线程不再重复初始化表（已在主线程初始化）
+        with get_conn() as conn:
+            written = save_data(conn, *(list(column) for column in zip(*records)))
+    except Exception as e:
+        print(f"数据库操作失败（页码：{page}）: {e}")
+    if on_written is not None:
+        # save_data 返回实际写入条数（内容未变化的车源不计），失败时为 None
+        on_written(written is not None)
+
+
+def replay(pages, writer=None, cache=None):
+    """离线回放：从响应缓存读取列表页解析入库，不访问网络、不处理图片
+
+    用于离线测量解析吞吐和入库链路，返回 (回放页数, 记录数)
+    """
+    from crawler import decode_html
+    cache = cache or ResponseCache()
+    replayed = records_total = 0
+    missing = []
+    parse_time = 0.0
+    for page in pages:
+        content = cache.body(LIST_URL.format(page=page))
+        if content is None:
+            missing.append(page)
+            continue
+        start = time.perf_counter()
+        records, _ = parse_list_page(decode_html(content))
+        parse_time += time.perf_counter() - start
+        cache.record('replayed')
+        replayed += 1
+        records_total += len(records)
+        if records:
+            store_records(records, writer, page)
+    if missing:
+        print(f"[REPLAY] {len(missing)} 页没有缓存: {missing[:20]}{' ...' if len(missing) > 20 else ''}")
+    print(f"[REPLAY] 回放 {replayed} 页，{records_total} 条记录，"
+          f"解析 {replayed / (parse_time or 1e-9):.1f} 页/秒")
+    return replayed, records_total
+
+
+def car(page=1, writer=None):
+    url = LIST_URL.format(page=page)
+    SAVE_DIR.mkdir(exist_ok=True)
+    try:
+        res = session.get(url, headers=HEADERS, timeout=(5, 10))
+        res.encoding = res.apparent_encoding
+    except Exception as e:
+        print(f"页面请求失败（页码：{page}）: {e}")
+        return
+
+    records, images = parse_list_page(res.text)
+    if records:
+        store_records(records, writer, page)
+
+    # 处理图片下载
+    jobs = image_jobs(images)
+    for idx, (link, name) in enumerate(jobs, 1):
+        file_path = SAVE_DIR / name
         try:
             resp = session.get(link, timeout=(5, 15))
             resp.raise_for_status()
             file_path.write_bytes(resp.content)
-            print(f"[OK]  {idx:02d}/{len(images)}  {file_path.name}")
+            print(f"[OK]  {idx:02d}/{len(jobs)}  {file_path.name}")
         except Exception as e:
-            print(f"[ERR] {idx:02d}/{len(images)}  {link}  ->  {e}")
+            print(f"[ERR] {idx:02d}/{len(jobs)}  {link}  ->  {e}")
             continue
 
         time.sleep(0.3)  # 控制爬取频率，避免被反爬
 
         # 保存图片到七牛云
         try:
-            img_key = f"car_images/{sname}_{img_index}{ext}"
-            if upload_to_bucket(str(file_path), img_key):
+            if upload_to_bucket(str(file_path), f"car_images/{name}"):
                 print(f"[UPL] {file_path.name} -> 七牛云成功")
         except Exception as e:
             print(f"[UPL_ERR] {file_path.name} -> 七牛云失败: {e}")
@@ -124,14 +270,7 @@ def reset_database():
     """重置数据库：删除现有数据库并重新创建"""
     try:
         # 连接到默认数据库（不指定db_name）
-        temp_conn = pymysql.connect(
-            host='localhost',
-            port=3306,
-            user='root',
-            passwd='1234',
-            charset='utf8mb4',
-            connect_timeout=10
-        )
+        temp_conn = pymysql.connect(**DB_CONFIG)
         
         # 删除现有数据库
         drop_database(temp_conn, 'car')
@@ -141,9 +280,8 @@ def reset_database():
         temp_conn.close()
         
         # 初始化表结构
-        conn = get_conn()
-        init_table(conn)
-        conn.close()
+        with get_conn() as conn:
+            init_table(conn)
         
         print("数据库重置完成")
         return True
@@ -177,40 +315,142 @@ def create_database(conn, db_name):
 
 
 if __name__ == "__main__":
-    # 重置数据库
-    print("正在重置数据库...")
-    if not reset_database():
-        print("数据库重置失败，程序退出")
-        sys.exit(1)
-    
-    # 清空图片目录
-    save_dir = Path("car_img")
-    if save_dir.exists():
-        import shutil
-        shutil.rmtree(save_dir)
-    save_dir.mkdir(exist_ok=True)
-    
-    print("开始爬取前100页数据...")
-    
-    # 启动多线程爬取（1-100页）
-    threads = []
-    active_threads = []
-    
-    for i in range(1, 101):  # 爬取前100页
-        t = threading.Thread(target=car, args=(i,))
-        threads.append(t)
-        active_threads.append(t)
-        t.start()
-        
-        # 控制并发数量，避免过多连接
-        if len(active_threads) >= 3:  # 最多同时运行3个线程
-            # 等待最早开始的线程完成
-            active_threads[0].join(timeout=60)  # 设置超时时间
-            active_threads.pop(0)
-        
-        time.sleep(1)  # 错开线程启动时间，减少并发压力
+    parser = argparse.ArgumentParser(description="二手车数据爬虫")
+    parser.add_argument('--direct', action='store_true',
+                        help="每个页面线程各自写库（旧方式，用于与批量写线程对比吞吐）")
+    parser.add_argument('--engine', choices=['async', 'thread'], default='async',
+                        help="抓取引擎：async 为 asyncio 并发引擎，thread 为旧的多线程方式（用于对比吞吐）")
+    parser.add_argument('--pages', type=int, default=100, help="抓取页数")
+    parser.add_argument('--resume', action='store_true', help="继续最近一次未完成的爬取，只抓待处理或失败的页面")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量爬取：只写入新车源，遇到整页都是已有车源时停止翻页")
+    parser.add_argument('--reset', action='store_true', help="删除并重建数据库、清空图片目录后全量爬取")
+    parser.add_argument('--no-cache', action='store_true', help="不使用 HTTP 响应缓存（不发条件请求）")
+    parser.add_argument('--replay', action='store_true',
+                        help="离线回放：只从响应缓存解析入库，不访问网络（用于测量解析与入库吞吐）")
+    parser.add_argument('--host-rate', type=float, default=3.0,
+                        help="每个域名的初始请求速率（次/秒），之后按响应延迟和限流情况自动调整")
+    parser.add_argument('--no-thumbnails', action='store_true', help="不生成、上传缩略图")
+    parser.add_argument('--details', action='store_true',
+                        help="列表页爬取完成后抓取详情页参数（只抓还没有详情或信息有变化的车源；--pages 0 时只抓详情）")
+    parser.add_argument('--detail-limit', type=int, default=1000, help="每次最多抓取的详情页数")
+    parser.add_argument('--bench-parse', nargs='*', metavar='HTML',
+                        help="对比 lxml 与 BeautifulSoup 的解析吞吐：使用给定的 HTML 文件，未给出时使用响应缓存中的列表页")
+    args = parser.parse_args()
+    if args.bench_parse is not None:
+        if args.bench_parse:
+            documents = [Path(path).read_text(encoding='utf-8', errors='replace') for path in args.bench_parse]
+        else:
+            from crawler import decode_html
+            cache = ResponseCache()
+            bodies = (cache.body(LIST_URL.format(page=page)) for page in range(1, args.pages + 1))
+            documents = [decode_html(body) for body in bodies if body is not None]
+        if not documents:
+            print("没有可用于基准测试的列表页，请先爬取一次或指定 HTML 文件")
+            sys.exit(1)
+        sys.exit(0 if benchmark_parsers(documents) else 1)
+    if args.engine == 'thread' and (args.resume or args.incremental):
+        parser.error("--resume/--incremental 仅支持 async 引擎")
+    if args.replay and (args.resume or args.incremental or args.no_cache):
+        parser.error("--replay 不能与 --resume/--incremental/--no-cache 同时使用")
+
+    if args.reset:
+        # 重置数据库
+        print("正在重置数据库...")
+        if not reset_database():
+            print("数据库重置失败，程序退出")
+            sys.exit(1)
+
+        # 清空图片目录
+        if SAVE_DIR.exists():
+            import shutil
+            shutil.rmtree(SAVE_DIR)
+    else:
+        # 保留已有数据，只补齐表结构
+        with get_conn() as conn:
+            init_table(conn)
+    SAVE_DIR.mkdir(exist_ok=True)
+    with get_conn() as conn:
+        init_crawl_tables(conn)
+        init_image_tables(conn)
+        # 已上传图片清单（内容哈希），内容未变的图片不再上传
+        manifest = ImageManifest().load(conn)
+
+    pages = list(range(1, args.pages + 1))
+    run_id = None
+    cache = None if args.no_cache else ResponseCache()
+    if args.engine == 'async' and not args.replay:
+        if args.resume or args.incremental:
+            last = last_successful_run()
+            if last:
+                print(f"上次成功完成的爬取: 第 {last['id']} 次（{last['mode']}，{last['pages_total']} 页，"
+                      f"完成于 {last['finished_at']}）")
+            else:
+                print("还没有成功完成的爬取")
+        if args.resume:
+            run_id, pages = resume_run()
+            if run_id is None:
+                print("没有未完成的爬取")
+                sys.exit(0)
+            print(f"继续第 {run_id} 次爬取，待抓取 {len(pages)} 页")
+        else:
+            run_id = start_run(pages, 'incremental' if args.incremental else 'full')
 
-    # 等待所有线程完成
-    for t in active_threads:
-        t.join(timeout=60)  # 设置超时时间
-    print('全部爬取完成')
\ No newline at end of file
+    print(f"开始爬取 {len(pages)} 页数据...")
+
+    # 入库写线程：页面只负责解析，写线程批量写入
+    writer = None if args.direct else IngestWriter().start()
+    crawl_start = time.perf_counter()
+
+    if args.replay:
+        replay(pages, writer=writer, cache=cache)
+    elif args.engine == 'async':
+        from crawler import crawl
+        try:
+            crawl(pages, writer=writer, run_id=run_id, incremental=args.incremental, cache=cache,
+                  manifest=manifest, with_variants=not args.no_thumbnails, host_rate=args.host_rate)
+        except KeyboardInterrupt:
+            print("爬取已取消，可使用 --resume 继续")
+    else:
+        # 启动多线程爬取
+        threads = []
+        active_threads = []
+
+        for i in pages:
+            t = threading.Thread(target=car, args=(i, writer))
+            threads.append(t)
+            active_threads.append(t)
+            t.start()
+
+            # 控制并发数量，避免过多连接
+            if len(active_threads) >= 3:  # 最多同时运行3个线程
+                # 等待最早开始的线程完成
+                active_threads[0].join(timeout=60)  # 设置超时时间
+                active_threads.pop(0)
+
+            time.sleep(1)  # 错开线程启动时间，减少并发压力
+
+        # 等待所有线程完成
+        for t in active_threads:
+            t.join(timeout=60)  # 设置超时时间
+    if writer is not None:
+        writer.close()
+    if cache is not None:
+        cache_stats = cache.stats()
+        print(f"[CACHE] 未修改(304) {cache_stats['not_modified']}，重新下载 {cache_stats['fetched']}，"
+              f"写入缓存 {cache_stats['stored']}，离线回放 {cache_stats['replayed']}")
+    image_stats = manifest.stats()
+    if any(image_stats.values()):
+        print(f"[IMAGES] 上传 {image_stats['uploaded']}，服务端复制 {image_stats['copied']}，"
+              f"内容未变跳过 {image_stats['skipped']}，节省上传 {image_stats['bytes_saved'] / 1024 / 1024:.1f} MB")
+    if run_id is not None:
+        print(f"第 {run_id} 次爬取状态: {finish_run(run_id)}")
+    if args.details:
+        # 列表数据已全部写入，按 infoid/dealerid 抓取详情页
+        from detail_crawler import crawl_details
+        try:
+            crawl_details(limit=args.detail_limit, cache=cache, host_rate=args.host_rate)
+        except KeyboardInterrupt:
+            print("详情抓取已取消")
+    print(f'全部爬取完成，用时 {time.perf_counter() - crawl_start:.1f} 秒，'
+          f'{len(pages) / (time.perf_counter() - crawl_start):.2f} 页/秒')
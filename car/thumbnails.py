@@ -0,0 +1,35 @@
+# 图片衍生尺寸：入库时把原图缩放为固定尺寸的 WebP 和 JPEG（兜底），减少列表页流量
+from io import BytesIO
+from utils import IMAGE_VARIANTS, IMAGE_VARIANT_FORMATS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:     # 未安装 Pillow 时不生成衍生图，页面回退到原图
+    Image = None
+
+THUMB_QUALITY = 80          # WebP/JPEG 压缩质量
+_SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': THUMB_QUALITY, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': THUMB_QUALITY, 'optimize': True, 'progressive': True},
+}
+
+
+def available():
+    return Image is not None
+
+
+def make_variants(data, variants=IMAGE_VARIANTS, formats=IMAGE_VARIANT_FORMATS):
+    """把原图数据缩放为各个衍生尺寸，返回 [(尺寸名, 格式, 图片数据), ...]
+
+    从大到小依次缩放，每次都在上一个结果上继续缩小；原图比目标尺寸小时不放大
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    results = []
+    for size, box in sorted(variants.items(), key=lambda item: item[1], reverse=True):
+        image.thumbnail(box, Image.LANCZOS)
+        for fmt in formats:
+            buffer = BytesIO()
+            image.save(buffer, **_SAVE_OPTIONS[fmt])
+            results.append((size, fmt, buffer.getvalue()))
+    return results
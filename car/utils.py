@@ -1,4 +1,7 @@
 # 工具函数和统一配置
+from collections import OrderedDict
+import threading
+import time
 import qiniu
 
 # 七牛云配置
@@ -12,4 +15,136 @@ q = qiniu.Auth(ACCESS_KEY, SECRET_KEY)
 
 def safe_name(name):
     """统一处理文件名安全字符"""
-    return "".join(c if c.isalnum() or c in "._- " else "_" for c in name)
\ No newline at end of file
+    return "".join(c if c.isalnum() or c in "._- " else "_" for c in name)
+
+
+# 图片衍生尺寸：名称 -> 最大宽高（等比缩放，不放大），入库时生成 WebP 和 JPEG 两种格式
+IMAGE_VARIANTS = {
+    'card': (400, 300),      # 列表、推荐卡片（h-48）
+    'hero': (800, 600),      # 首页轮播
+    'detail': (1200, 900),   # 详情页大图
+}
+IMAGE_VARIANT_FORMATS = ('webp', 'jpg')
+
+
+def variant_key(name, size, fmt):
+    """原图文件名对应的衍生图 key，如 宝马_1.jpg -> car_images/card/宝马_1.webp"""
+    stem = name.rsplit('.', 1)[0]
+    return f"car_images/{size}/{stem}.{fmt}"
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存，条目可带过期时间（time.time() 时间戳）
+
+    统计命中、未命中、淘汰次数，以及未命中后生成结果的耗时（由 put 的 cost 传入，
+    在 stats() 中以 {time_name}_total / {time_name}_avg 给出）
+    """
+
+    def __init__(self, max_size, ttl=None, time_name='build_time'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.time_name = time_name
+        self._items = OrderedDict()     # key -> (值, 过期时间或 None)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, f'{time_name}_total': 0.0}
+
+    def get(self, key):
+        """命中返回缓存值并计为命中；不存在或已过期返回 None 并计为未命中"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and (item[1] is None or now < item[1]):
+                self._items.move_to_end(key)
+                self._counters['hits'] += 1
+                return item[0]
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, value, cost=0.0, expires=None):
+        """写入缓存；expires 为空时按 ttl 计算（没有 ttl 则不过期）"""
+        if expires is None and self.ttl:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._counters[f'{self.time_name}_total'] += cost
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def count(self, name):
+        """累加一个自定义计数器"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        """命中率、平均耗时等计数器"""
+        with self._lock:
+            data = dict(self._counters)
+            data['size'] = len(self._items)
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        total = data[f'{self.time_name}_total']
+        data[f'{self.time_name}_avg'] = total / data['misses'] if data['misses'] else 0.0
+        return data
+
+
+# 图片私有链接签名配置
+SIGNED_URL_EXPIRES = 3600       # 签名有效期（秒）
+SIGNED_URL_BUCKET = 600         # 截止时间按该粒度对齐，同一时间窗内签出的链接截止时间相同
+SIGNED_URL_MIN_TTL = 300        # 剩余有效期低于该值时重新签名
+SIGNED_URL_CACHE_SIZE = 20000   # 最多缓存的链接数
+
+
+def sign_private_url(url, deadline):
+    """按指定截止时间生成七牛私有下载链接（与 q.private_download_url 格式一致）"""
+    url = f"{url}{'&' if '?' in url else '?'}e={deadline}"
+    return f"{url}&token={q.token(url)}"
+
+
+class SignedUrlCache:
+    """签名链接缓存：按 key 复用未临近过期的链接，容量有限，LRU 淘汰"""
+
+    def __init__(self, max_size=SIGNED_URL_CACHE_SIZE, expires=SIGNED_URL_EXPIRES,
+                 bucket=SIGNED_URL_BUCKET, min_ttl=SIGNED_URL_MIN_TTL):
+        self.expires = expires
+        self.bucket = bucket
+        self.min_ttl = min_ttl
+        self._cache = LRUCache(max_size, time_name='sign_time')
+
+    def get(self, key, build_url):
+        """取 key 对应的签名链接；未命中或临近过期时用 build_url() 生成原始链接并签名"""
+        signed = self._cache.get(key)
+        if signed is not None:
+            return signed
+        start = time.perf_counter()
+        deadline = (int(time.time()) + self.expires) // self.bucket * self.bucket
+        signed = sign_private_url(build_url(), deadline)
+        # 剩余有效期低于 min_ttl 后视为过期，重新签名
+        self._cache.put(key, signed, cost=time.perf_counter() - start, expires=deadline - self.min_ttl)
+        return signed
+
+    def stats(self):
+        """命中率、签名耗时等计数器"""
+        return self._cache.stats()
+
+
+# 页面渲染缓存配置
+PAGE_CACHE_SIZE = 256           # 最多缓存的页面数
+FRAGMENT_CACHE_TTL = 60         # 页面片段（如首页推荐区块）的缓存时间（秒）
+
+
+class PageCache(LRUCache):
+    """渲染结果缓存：LRU 淘汰，可选 TTL；记录命中、未命中、绕过次数和渲染耗时"""
+
+    def __init__(self, max_size=PAGE_CACHE_SIZE, ttl=None):
+        super().__init__(max_size, ttl=ttl, time_name='render_time')
+        self._counters['bypass'] = 0
+
+    def bypass(self):
+        """记录一次不走缓存的请求（如登录用户）"""
+        self.count('bypass')
@@ -0,0 +1,5 @@
+# car/ 下的模块互相以顶层模块名导入（from database import ...），测试时同样加入搜索路径
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'car'))
@@ -0,0 +1,149 @@
+import asyncio
+import pytest
+from aiohttp import web
+import crawler
+from http_cache import ResponseCache
+from crawl_state import PAGE_DONE, PAGE_FAILED
+
+LIST_HTML = ('<ul><li infoid="{page}" dealerid="1"><span class="title">宝马 X5</span>'
+             '<span class="detail-r">￥10万</span><span class="detail-l">2020年/3万公里</span>'
+             '<img name="LazyloadImg" src2="{base}/img/{page}.jpg" title="宝马 X5 {page}"></li></ul>')
+
+
+async def _serve(routes):
+    app = web.Application()
+    for path, handler in routes:
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+@pytest.fixture
+def marks(monkeypatch):
+    """记录 mark_page 调用，入库直接视为成功"""
+    calls = []
+    monkeypatch.setattr(crawler, 'mark_page', lambda run_id, page, status, records=0, error=None:
+                        calls.append((page, status)))
+
+    def store_records(records, writer=None, page=None, on_written=None):
+        on_written(True)
+    monkeypatch.setattr(crawler, 'store_records', store_records)
+    return calls
+
+
+def _crawl(monkeypatch, routes, pages, **kwargs):
+    async def main():
+        runner, base = await _serve(routes)
+        monkeypatch.setattr(crawler, 'LIST_URL', base + '/list/{page}')
+        try:
+            return await crawler.AsyncCrawler(run_id=1, **kwargs).run(pages)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_page_timeout_excludes_waiting_for_a_page_slot(monkeypatch, marks):
+    async def list_page(request):
+        await asyncio.sleep(0.2)
+        base = f'http://{request.host}'
+        return web.Response(text=LIST_HTML.format(page=request.match_info['page'], base=base),
+                            content_type='text/html')
+
+    pages = list(range(1, 31))
+    stats = _crawl(monkeypatch, [('/list/{page}', list_page)], pages, concurrency=4, per_host=4,
+                   host_rate=crawler.CRAWL_HOST_MAX_RATE, page_timeout=1, with_images=False)
+    assert stats['pages'] == 30 and stats['pages_failed'] == 0
+    assert sorted(page for page, status in marks if status == PAGE_DONE) == pages
+    assert not [page for page, status in marks if status == PAGE_FAILED]
+
+
+def test_full_download_queue_does_not_hold_page_slots(monkeypatch, marks):
+    pages = list(range(1, 11))
+    state = {'first_image': True, 'pages_finished_first': False}
+
+    async def list_page(request):
+        return web.Response(text=LIST_HTML.format(page=request.match_info['page'], base=f'http://{request.host}'),
+                            content_type='text/html')
+
+    async def image(request):
+        # 第一张图片下载卡住，直到所有页面都已入库（页面阶段被下载队列阻塞时会一直等到超时）
+        if state['first_image']:
+            state['first_image'] = False
+            for _ in range(60):
+                if len([page for page, status in marks if status == PAGE_DONE]) == len(pages):
+                    state['pages_finished_first'] = True
+                    break
+                await asyncio.sleep(0.05)
+        return web.Response(body=b'jpeg', content_type='image/jpeg')
+
+    monkeypatch.setattr(crawler, 'DOWNLOAD_QUEUE_SIZE', 1)
+    monkeypatch.setattr(crawler, 'upload_bytes', lambda content, key: True)
+    stats = _crawl(monkeypatch, [('/list/{page}', list_page), ('/img/{name}', image)], pages,
+                   concurrency=2, per_host=2, host_rate=crawler.CRAWL_HOST_MAX_RATE,
+                   download_workers=1, with_variants=False)
+    assert state['pages_finished_first']
+    assert stats['pages'] == len(pages) and stats['images'] == len(pages) and stats['uploads'] == len(pages)
+
+
+class FakeManifest:
+    """内存中的图片清单：登记上传过的 key，相同 key 再次上传视为内容未变"""
+
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    def has(self, key):
+        return key in self.keys
+
+    def store(self, content, key, upload, copy):
+        if key in self.keys:
+            return crawler.IMAGE_SKIPPED
+        self.keys.add(key)
+        return crawler.IMAGE_UPLOADED
+
+
+def test_unchanged_image_without_variants_is_downloaded_again(monkeypatch, marks, tmp_path):
+    requests = []
+
+    async def list_page(request):
+        return web.Response(text=LIST_HTML.format(page=request.match_info['page'], base=f'http://{request.host}'),
+                            content_type='text/html')
+
+    async def image(request):
+        requests.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=b'jpeg', content_type='image/jpeg', headers={'ETag': '"v1"'})
+
+    monkeypatch.setattr(crawler.thumbnails, 'available', lambda: True)
+    monkeypatch.setattr(crawler.thumbnails, 'make_variants', lambda data: [
+        (size, fmt, b'thumb') for size in crawler.IMAGE_VARIANTS for fmt in crawler.IMAGE_VARIANT_FORMATS])
+    cache = ResponseCache(tmp_path)
+    manifest = FakeManifest()
+
+    async def main():
+        runner, base = await _serve([('/list/{page}', list_page), ('/img/{name}', image)])
+        monkeypatch.setattr(crawler, 'LIST_URL', base + '/list/{page}')
+        try:
+            results = []
+            # 旧版只上传原图，之后两次爬取生成缩略图
+            for with_variants in (False, True, True):
+                crawl = crawler.AsyncCrawler(run_id=1, cache=cache, manifest=manifest, with_variants=with_variants,
+                                             host_rate=crawler.CRAWL_HOST_MAX_RATE)
+                results.append(dict(await crawl.run([1])))
+            return results
+        finally:
+            await runner.cleanup()
+
+    first, second, third = asyncio.run(main())
+    variants = len(crawler.IMAGE_VARIANTS) * len(crawler.IMAGE_VARIANT_FORMATS)
+    assert first['uploads'] == 1 and first['variants'] == 0
+    # 原图未变但缺少缩略图：不发条件请求，下载后补齐缩略图
+    assert second['images_unchanged'] == 0 and second['variants'] == variants
+    assert requests[1] is None
+    # 缩略图补齐后恢复条件请求
+    assert third['images_unchanged'] == 1 and third['variants'] == 0
+    assert requests[2] == '"v1"'
@@ -0,0 +1,198 @@
+import uuid
+import pymysql
+import pytest
+import database
+
+
+class FakeCursor:
+    """记录执行的语句；按 infoid 查询已有车源时返回预设的旧行"""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.executed = []
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self._result = list(self.existing) if 'FROM carprice WHERE infoid IN' in sql else []
+
+    def executemany(self, sql, rows):
+        self.executed.append((sql, list(rows)))
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConn:
+    def __init__(self, existing=()):
+        self.cur = FakeCursor(existing)
+
+    def cursor(self, cursor_class=None):
+        return self.cur
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _update_rows(conn):
+    return [rows for sql, rows in conn.cur.executed if sql.strip().startswith('UPDATE carprice')][0]
+
+
+def test_save_data_passes_previous_price_on_change():
+    old = {'id': 7, 'infoid': 100, 'carmoney': '10万', 'content_hash': 'old', 'brand': '宝马',
+           'price_wan': 10, 'reg_year': 2020, 'mileage_km': 30000}
+    conn = FakeConn([old])
+    assert database.save_data(conn, ['宝马 X5'], ['12万'], ['2020年/3万公里'], [100], [1]) == 1
+    row = _update_rows(conn)[0]
+    # ..., content_hash, 是否变价, 旧价格, 是否变价, id
+    assert row[-4:] == (True, '10万', True, 7)
+    assert row[1] == '12万'
+
+
+def test_save_data_keeps_previous_price_when_unchanged():
+    old = {'id': 7, 'infoid': 100, 'carmoney': '10万', 'content_hash': 'old', 'brand': '宝马',
+           'price_wan': 10, 'reg_year': 2020, 'mileage_km': 30000}
+    conn = FakeConn([old])
+    database.save_data(conn, ['宝马 X5 新款'], ['10万'], ['2020年/3万公里'], [100], [1])
+    assert _update_rows(conn)[0][-4:] == (False, '10万', False, 7)
+
+
+class RacingCursor(FakeCursor):
+    """第一次插入时另一个写入者已提交了同一车源"""
+
+    def __init__(self, racer):
+        super().__init__(())
+        self.racer = racer
+
+    def executemany(self, sql, rows):
+        if sql.strip().startswith('INSERT INTO carprice') and not self.existing:
+            self.existing = [self.racer]
+            raise pymysql.err.IntegrityError(1062, "Duplicate entry '100' for key 'uk_infoid'")
+        super().executemany(sql, rows)
+
+
+def test_save_data_retries_duplicate_insert_as_update():
+    racer = {'id': 9, 'infoid': 100, 'carmoney': '10万', 'content_hash': 'racer', 'brand': '宝马',
+             'price_wan': 10, 'reg_year': 2020, 'mileage_km': 30000}
+    conn = FakeConn()
+    conn.cur = RacingCursor(racer)
+    assert database.save_data(conn, ['宝马 X5'], ['12万'], ['2020年/3万公里'], [100], [1]) == 1
+    assert _update_rows(conn)[0][-1] == 9
+
+
+def test_save_data_returns_written_count():
+    digest = database.content_hash('宝马 X5', '10万', '2020年/3万公里')
+    old = {'id': 7, 'infoid': 100, 'carmoney': '10万', 'content_hash': digest, 'brand': '宝马',
+           'price_wan': 10, 'reg_year': 2020, 'mileage_km': 30000}
+    # 一条未变化、一条新车源
+    assert database.save_data(FakeConn([old]), ['宝马 X5', '奥迪 A6'], ['10万', '20万'],
+                              ['2020年/3万公里'] * 2, [100, 101], [1, 1]) == 1
+    assert database.save_data(FakeConn([old]), ['宝马 X5'], ['10万'], ['2020年/3万公里'], [100], [1]) == 0
+
+
+def test_save_data_returns_none_on_failure():
+    class BrokenCursor(FakeCursor):
+        def executemany(self, sql, rows):
+            raise pymysql.err.OperationalError(1146, "Table 'car.carprice' doesn't exist")
+    conn = FakeConn()
+    conn.cur = BrokenCursor(())
+    assert database.save_data(conn, ['宝马 X5'], ['10万'], ['2020年/3万公里'], [100], [1]) is None
+
+
+@pytest.fixture
+def mysql_db():
+    """临时数据库（连不上 MySQL 时跳过）"""
+    name = f"car_test_{uuid.uuid4().hex[:8]}"
+    try:
+        admin = pymysql.connect(**database.DB_CONFIG)
+    except pymysql.err.MySQLError as e:
+        pytest.skip(f"MySQL 不可用: {e}")
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {name} CHARACTER SET utf8mb4")
+    conn = pymysql.connect(db=name, **database.DB_CONFIG)
+    try:
+        database.init_table(conn)
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE {name}")
+        admin.close()
+
+
+def test_save_data_records_price_change_in_mysql(mysql_db):
+    database.save_data(mysql_db, ['宝马 X5'], ['10万'], ['2020年/3万公里'], [100], [1])
+    database.save_data(mysql_db, ['宝马 X5'], ['12万'], ['2020年/3万公里'], [100], [1])
+    with mysql_db.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("SELECT carmoney, prev_carmoney, price_changed_at FROM carprice WHERE infoid = 100")
+        row = cursor.fetchone()
+    assert row['carmoney'] == '12万'
+    assert row['prev_carmoney'] == '10万'
+    assert row['price_changed_at'] is not None
+
+
+def test_upgrade_normalized_runs_once(monkeypatch):
+    class VersionCursor(FakeCursor):
+        def fetchone(self):
+            return version
+
+    calls = []
+    monkeypatch.setattr(database, 'backfill_normalized', lambda conn, obfuscated=False: calls.append(obfuscated) or 3)
+    monkeypatch.setattr(database, 'rebuild_statistics', lambda conn: calls.append('stats') or True)
+    conn = FakeConn()
+    conn.cur = VersionCursor(())
+
+    version = (database.NORMALIZE_VERSION,)
+    assert database.upgrade_normalized(conn) is False
+    assert calls == []
+
+    version = None
+    assert database.upgrade_normalized(conn) is True
+    assert calls == [True, 'stats']
+    assert conn.cur.executed[-1][1] == (database.NORMALIZE_VERSION,)
+
+
+def test_upgrade_normalized_reparses_obfuscated_rows_in_mysql(mysql_db):
+    with mysql_db.cursor() as cursor:
+        # 旧解析规则写入的错误字段
+        cursor.execute("""
+            INSERT INTO carprice (carname, carmoney, caryear, brand, price_wan, reg_year, mileage_km)
+            VALUES ('宝马 X5', %s, %s, '宝马', 1.0, NULL, 20000)
+        """, ('￥1\ue0005.80万', '20\ue00023年/3\ue000.2万公里'))
+        cursor.execute("UPDATE catalog_meta SET value = 1 WHERE name = 'normalize_version'")
+    mysql_db.commit()
+    assert database.upgrade_normalized(mysql_db) is True
+    with mysql_db.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("SELECT price_wan, reg_year, mileage_km FROM carprice")
+        row = cursor.fetchone()
+        cursor.execute("SELECT value_sum FROM stats_summary WHERE metric = 'price_wan'")
+        price_sum = cursor.fetchone()['value_sum']
+    assert (float(row['price_wan']), row['reg_year'], row['mileage_km']) == (15.8, 2023, 32000)
+    assert float(price_sum) == 15.8
+
+
+def test_failed_detail_targets_wait_for_retry_in_mysql(mysql_db):
+    database.save_data(mysql_db, ['宝马 X5', '奥迪 A6'], ['10万', '20万'], ['2020年/3万公里'] * 2, [100, 101], [1, 1])
+    assert sorted(database.pending_detail_targets(mysql_db)) == [(100, 1), (101, 1)]
+    database.record_detail_failures(mysql_db, [(100, 1)])
+    assert database.pending_detail_targets(mysql_db) == [(101, 1)]
+    database.record_detail_failures(mysql_db, [(100, 1)])
+    with mysql_db.cursor() as cursor:
+        cursor.execute("""
+            SELECT attempts, TIMESTAMPDIFF(HOUR, NOW(), next_try_at) FROM car_detail_attrs WHERE infoid = 100
+        """)
+        attempts, hours = cursor.fetchone()
+    assert attempts == 2 and hours >= database.DETAIL_RETRY_HOURS * 2 - 1
+    database.save_detail_attrs(mysql_db, [(100, 1, {'变速箱': '自动'})])
+    with mysql_db.cursor() as cursor:
+        cursor.execute("SELECT attempts, next_try_at FROM car_detail_attrs WHERE infoid = 100")
+        assert cursor.fetchone() == (0, None)
@@ -0,0 +1,43 @@
+import asyncio
+from aiohttp import web
+import crawler
+import detail_crawler
+
+DETAIL_HTML = ('<ul class="basic-item-ul"><li><span class="item-name">变速箱</span>自动</li>'
+               '<li><span class="item-name">排量</span>2.0T</li></ul>')
+
+
+def test_failed_and_empty_details_are_recorded(monkeypatch):
+    saved, missed = [], []
+
+    async def detail(request):
+        infoid = int(request.match_info['infoid'])
+        if infoid == 1:
+            return web.Response(text=DETAIL_HTML, content_type='text/html')
+        if infoid == 2:
+            return web.Response(text='<html><body>车源已下架</body></html>', content_type='text/html')
+        return web.Response(status=404)
+
+    monkeypatch.setattr(detail_crawler.DetailCrawler, '_save',
+                        staticmethod(lambda batch: saved.extend(batch) or len(batch)))
+    monkeypatch.setattr(detail_crawler.DetailCrawler, '_record_misses', staticmethod(missed.extend))
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/dealer/{dealerid}/{infoid}.html', detail)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(detail_crawler, 'DETAIL_URL',
+                            f'http://127.0.0.1:{port}/dealer/{{dealerid}}/{{infoid}}.html')
+        try:
+            return await detail_crawler.DetailCrawler(host_rate=crawler.CRAWL_HOST_MAX_RATE).run([(1, 9), (2, 9), (3, 9)])
+        finally:
+            await runner.cleanup()
+
+    stats = asyncio.run(main())
+    assert [(infoid, attrs) for infoid, _, attrs in saved] == [(1, {'变速箱': '自动', '排量': '2.0T'})]
+    assert sorted(missed) == [(2, 9), (3, 9)]
+    assert (stats['details'], stats['details_empty'], stats['details_failed']) == (1, 1, 1)
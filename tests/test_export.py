@@ -0,0 +1,21 @@
+import pytest
+import app as app_module
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def no_database():
+        raise AssertionError("参数错误时不应访问数据库")
+    monkeypatch.setattr(app_module, 'get_conn', no_database)
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('since', ['1e20', 'inf', '-inf', 'nan', 'yesterday'])
+def test_export_rejects_bad_updated_since(client, since):
+    response = client.get(f'/api/cars/export?updated_since={since}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_export_rejects_unknown_format(client):
+    assert client.get('/api/cars/export?format=xml').status_code == 400
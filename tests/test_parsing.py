@@ -0,0 +1,24 @@
+import pytest
+from parsing import parse_caryear, parse_price, OBFUSCATION_CHAR as M
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('￥15.80万', 15.8),
+    (f'￥1{M}5.80万', 15.8),
+    (f'￥{M}15.8{M}0万', 15.8),
+    ('1,280.00万', 1280.0),
+    ('面议', None),
+])
+def test_parse_price_strips_obfuscation(raw, expected):
+    assert parse_price(raw) == expected
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('2023年/3.2万公里', (2023, 32000)),
+    (f'2023年/3{M}.2万公里', (2023, 32000)),
+    (f'20{M}23年/3.2万公里', (2023, 32000)),
+    (f'2019年/8{M}000公里', (2019, 8000)),
+    ('', (None, None)),
+])
+def test_parse_caryear_strips_obfuscation(raw, expected):
+    assert parse_caryear(raw) == expected
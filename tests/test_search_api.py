@@ -0,0 +1,21 @@
+import app as app_module
+
+
+def test_search_api_checks_data_version_before_searching(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'get_data_version', lambda conn=None: calls.append('version'))
+    monkeypatch.setattr(app_module.search_index, 'search',
+                        lambda query, page=1: calls.append('search') or ([], 0))
+    response = app_module.app.test_client().get('/api/search?q=宝马')
+    assert response.status_code == 200
+    assert calls == ['version', 'search']
+
+
+def test_search_api_survives_data_version_error(monkeypatch):
+    def unavailable(conn=None):
+        raise RuntimeError("数据库不可用")
+    monkeypatch.setattr(app_module, 'get_data_version', unavailable)
+    monkeypatch.setattr(app_module.search_index, 'search', lambda query, page=1: ([], 0))
+    response = app_module.app.test_client().get('/api/search?q=宝马')
+    assert response.status_code == 200
+    assert response.get_json()['total'] == 0